@@ -0,0 +1,175 @@
+#! /usr/bin/python3
+#
+# Measure the runtime and the peak memory consumption of the individual
+# stages of the scripts. By default, the benchmark runs on synthetic
+# data produced by "generateSyntheticData.py", so neither the real data
+# nor network access is required.
+#
+# The results can be stored as a baseline, and later runs are compared
+# against it. A stage whose runtime or peak memory exceeds the baseline
+# by more than the given tolerance is considered a regression, which
+# makes the script exit with a non-zero status. Keep in mind that
+# baselines are only meaningful on the machine they were recorded on.
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import estimateR
+import generateSyntheticData
+
+def measure(func, repeat):
+    """Return the best wall clock time of `func()` and its peak memory use in bytes.
+
+    The peak memory is determined in a separate run because tracing
+    memory allocations slows down the code considerably.
+    """
+    bestTime = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        if bestTime is None or dt < bestTime:
+            bestTime = dt
+
+    tracemalloc.start()
+    func()
+    peakMemory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "seconds": bestTime,
+        "peakMemory": peakMemory,
+    }
+
+def runBenchmarks(dataDir, workDir, engines, numProcesses, repeat):
+    results = {}
+
+    def stage(name, func):
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = measure(func, repeat)
+
+    for engine in engines:
+        stage(f"createDatabase[{engine}]",
+              lambda: estimateR.createDatabase(cacheFileName=None, engine=engine, dataDir=dataDir))
+
+    cacheFileName = os.path.join(workDir, "estimateR-cache.json")
+    # populate the cache. this includes the parsing of all files
+    estimateR.createDatabase(cacheFileName=cacheFileName, dataDir=dataDir)
+    stage("createDatabase[cached]",
+          lambda: estimateR.createDatabase(cacheFileName=cacheFileName, dataDir=dataDir))
+
+    if numProcesses != 1:
+        stage(f"createDatabase[jobs={numProcesses or os.cpu_count()}]",
+              lambda: estimateR.createDatabase(cacheFileName=None, numProcesses=numProcesses, dataDir=dataDir))
+
+    db = estimateR.createDatabase(cacheFileName=cacheFileName, dataDir=dataDir)
+
+    def filterAll():
+        for entry in db.values():
+            estimateR.boxFilter(entry["timeList"], entry["deltaCases"], 7)
+            estimateR.boxFilter(entry["timeList"], entry["estimatedR"], 7)
+    stage("boxFilter", filterAll)
+
+    def printAll():
+        for country in db:
+            estimateR.printCountryCsv(db, country, io.StringIO())
+    stage("printCountryCsv", printAll)
+
+    return results
+
+def compareResults(results, baseline, tolerance):
+    """Print the results next to the baseline and return the names of the stages which regressed."""
+    regressions = []
+
+    print(f"{'stage':<32} {'seconds':>10} {'baseline':>10} {'peak MiB':>10} {'baseline':>10}")
+    for name, r in results.items():
+        b = baseline.get(name)
+        line = f"{name:<32} {r['seconds']:>10.3f} "
+        line += f"{b['seconds']:>10.3f} " if b else f"{'-':>10} "
+        line += f"{r['peakMemory']/2**20:>10.1f} "
+        line += f"{b['peakMemory']/2**20:>10.1f}" if b else f"{'-':>10}"
+
+        if b and (r["seconds"] > b["seconds"]*tolerance or r["peakMemory"] > b["peakMemory"]*tolerance):
+            line += "  REGRESSION"
+            regressions.append(name)
+
+        print(line)
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the R estimation.")
+    parser.add_argument("--data-dir",
+                        help="use the daily reports of this directory instead of synthetic ones")
+    parser.add_argument("--days", type=int, default=900,
+                        help="the number of synthetic daily reports")
+    parser.add_argument("--countries", type=int, default=200,
+                        help="the number of synthetic countries")
+    parser.add_argument("--provinces", type=int, default=5,
+                        help="the number of provinces of each synthetic country")
+    parser.add_argument("--engines", default="python",
+                        help="comma separated list of the estimation engines to benchmark")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="additionally benchmark parsing with this number of processes. 0 means one per CPU")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="the number of runs of each stage. the fastest one counts")
+    parser.add_argument("--baseline", default="benchmark-baseline.json",
+                        help="the file containing the baseline results")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=1.2,
+                        help="the factor by which a stage may exceed the baseline")
+    parser.add_argument("--output",
+                        help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    parameters = {
+        "dataDir": args.data_dir,
+        "days": args.days,
+        "countries": args.countries,
+        "provinces": args.provinces,
+    }
+
+    with tempfile.TemporaryDirectory() as workDir:
+        dataDir = args.data_dir
+        if dataDir is None:
+            dataDir = os.path.join(workDir, "daily_reports")
+            print("generating synthetic data...", file=sys.stderr)
+            generateSyntheticData.generate(dataDir,
+                                           numDays=args.days,
+                                           numCountries=args.countries,
+                                           numProvinces=args.provinces)
+
+        results = runBenchmarks(dataDir, workDir, args.engines.split(","), args.jobs, args.repeat)
+
+    report = {
+        "parameters": parameters,
+        "stages": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselineReport = json.load(f)
+        if baselineReport["parameters"] == parameters:
+            baseline = baselineReport["stages"]
+        else:
+            print("warning: the baseline was recorded with different parameters, ignoring it", file=sys.stderr)
+
+    regressions = compareResults(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if regressions:
+        sys.exit(1)
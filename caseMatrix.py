@@ -0,0 +1,254 @@
+#! /usr/bin/python3
+#
+# An array based implementation of the estimation engine of
+# "estimateR.py". Instead of looping over the days of each country in
+# Python, the time series of all countries are stacked into the rows
+# of dense (countries x days) matrices and the derived series are
+# computed for all countries at once.
+#
+# The rows are aligned by index, not by date, i.e., column i of a row
+# is the i-th data point of the respective country. This mirrors what
+# the loops in estimateR.py do, so both engines produce the same
+# numbers. Missing values are represented by NaN.
+#
+# This module requires NumPy. It is only imported if the "numpy"
+# engine is selected, i.e., "estimateR.py" itself works without it.
+from array import array
+
+import numpy as np
+
+class CaseMatrix:
+    """The total case and death numbers of all countries of a database."""
+    def __init__(self, db):
+        self.countries = list(db)
+        self.lengths = np.array([len(db[c]) for c in self.countries], dtype=np.int64)
+
+        numDays = int(self.lengths.max()) if len(self.countries) else 0
+        self.totalCases = np.zeros((len(self.countries), numDays))
+        self.totalDeaths = np.zeros((len(self.countries), numDays))
+        # the ordinals of the dates of the entries
+        self.days = np.zeros((len(self.countries), numDays), dtype=np.int64)
+        for i, country in enumerate(self.countries):
+            entry = db[country]
+            n = self.lengths[i]
+            # all countries usually share the same date axis
+            if i == 0 or entry.dateAxis is not dateAxis:
+                dateAxis = entry.dateAxis
+                axisDays = np.array([t.toordinal() for t in dateAxis], dtype=np.int64)
+            self.days[i, :n] = axisDays[np.frombuffer(entry.dayIndices, dtype=np.intc)]
+            self.totalCases[i, :n] = np.frombuffer(entry.totalCases)
+            self.totalDeaths[i, :n] = np.frombuffer(entry.totalDeaths)
+
+    def validMask(self, offset=0):
+        """Return a boolean matrix which is true for all entries that exist.
+
+        `offset` is subtracted from the length of each row. This is
+        used for series which are shorter than the raw data.
+        """
+        numDays = self.totalCases.shape[1]
+        return np.arange(numDays)[np.newaxis, :] < (self.lengths - offset)[:, np.newaxis]
+
+def deltas(totals):
+    # the first two entries are taken verbatim and negative deltas are
+    # clipped. see computeDerivedSeries() in estimateR.py
+    result = totals.copy()
+    result[:, 2:] = np.maximum(0, totals[:, 2:] - totals[:, 1:-1])
+    return result
+
+def attributableWeights(deltaCases, weightsList, weightsOffset):
+    """Distribute the new cases of each day over its neighbours.
+
+    This is a one dimensional convolution of each row with the kernel
+    given by `weightsList`. It is done tap by tap on the whole matrix
+    because the kernel is short compared to the series. The taps are
+    processed in reverse order, so that the contributions are summed
+    up in the same order as the loop in estimateR.py.
+    """
+    numDays = deltaCases.shape[1]
+    result = np.zeros_like(deltaCases)
+    for j in reversed(range(len(weightsList))):
+        shift = weightsOffset + j
+        i0 = max(0, -shift)
+        i1 = min(numDays, numDays - shift)
+        if i0 >= i1:
+            continue
+
+        result[:, i0 + shift:i1 + shift] += weightsList[j] * deltaCases[:, i0:i1]
+
+    return result
+
+def estimatedR(totalCases, deltaCases, weights):
+    # the arguments may be of different shapes if this is used for
+    # multiple kernels, see sweepEstimatedR()
+    totalCases, deltaCases, weights = np.broadcast_arrays(totalCases, deltaCases, weights)
+    result = np.full(deltaCases.shape, np.nan)
+    mask = (totalCases >= 100) & (weights > 1e-10)
+    result[mask] = deltaCases[mask]/weights[mask]
+    return result
+
+def boxFilter(days, data, valid, n, offset=0):
+    """Batched version of estimateR.boxFilter().
+
+    `data` is a matrix where each row is a series to be filtered,
+    `days` holds the ordinal of the date of each entry and `valid`
+    tells which entries of it exist. The dates of each row must be
+    sorted. Like for the scalar version, the windows are defined by
+    calendar days and NaN entries are skipped.
+    """
+    numRows, numDays = data.shape
+    present = valid & ~np.isnan(data)
+    values = np.where(present, data, 0.0)
+
+    # prefix sums of the values and of the number of values which are
+    # present. cumsum() adds up the values sequentially, so this gives
+    # the same results as the prefix sums of the scalar version.
+    sums = np.zeros((numRows, numDays + 1))
+    np.cumsum(values, axis=1, out=sums[:, 1:])
+    counts = np.zeros((numRows, numDays + 1), dtype=np.int64)
+    np.cumsum(present, axis=1, out=counts[:, 1:])
+
+    # find the boundaries of the windows of all rows using a single
+    # binary search: the dates of each row are mapped into a disjoint
+    # range of keys. entries which do not exist are moved behind all
+    # dates of the row.
+    if valid.any():
+        firstDay = days[valid].min()
+        lastDay = days[valid].max()
+    else:
+        firstDay = lastDay = 0
+    margin = abs(offset) + n + 1
+    rowStride = lastDay - firstDay + 2*margin + 1
+    rowBase = (np.arange(numRows, dtype=np.int64)*rowStride)[:, np.newaxis]
+    relDays = np.where(valid, days - firstDay + margin, rowStride - 1)
+    keys = (rowBase + relDays).ravel()
+
+    colBase = (np.arange(numRows, dtype=np.int64)*numDays)[:, np.newaxis]
+    j0 = np.searchsorted(keys, (rowBase + relDays - n + 1 + offset).ravel(), side="left").reshape(numRows, numDays) - colBase
+    j1 = np.searchsorted(keys, (rowBase + relDays + offset).ravel(), side="right").reshape(numRows, numDays) - colBase
+    j0 = np.clip(j0, 0, numDays)
+    j1 = np.clip(j1, 0, numDays)
+
+    numValues = np.take_along_axis(counts, j1, axis=1) - np.take_along_axis(counts, j0, axis=1)
+    sumValues = np.take_along_axis(sums, j1, axis=1) - np.take_along_axis(sums, j0, axis=1)
+
+    result = np.full_like(values, np.nan)
+    mask = valid & (numValues > 0)
+    result[mask] = sumValues[mask]/numValues[mask]
+    return result
+
+def toArray(row, n):
+    return array("d", row[:n].tobytes())
+
+def computeDerivedSeries(db, weightsList, weightsOffset):
+    """Compute the derived series of all countries of a database at once.
+
+    This produces the same entries as estimateR.computeDerivedSeries().
+    """
+    m = CaseMatrix(db)
+    valid = m.validMask()
+
+    deltaCases = deltas(m.totalCases)
+    deltaDeaths = deltas(m.totalDeaths)
+
+    # death is delayed relative to confirmation for about 14 days. this
+    # series is thus 14 days shorter than the raw data.
+    totalCases2 = m.totalDeaths[:, 14:] * (712./13)
+    validCases2 = m.validMask(offset=14)[:, :totalCases2.shape[1]]
+    daysCases2 = m.days[:, :totalCases2.shape[1]]
+
+    weights = attributableWeights(deltaCases, weightsList, weightsOffset)
+    R = estimatedR(m.totalCases, deltaCases, weights)
+
+    totalCasesSmoothened = boxFilter(m.days, m.totalCases, valid, n=7)
+    totalCases2Smoothened = boxFilter(daysCases2, totalCases2, validCases2, n=7)
+    deltaCasesSmoothened = boxFilter(m.days, deltaCases, valid, n=7)
+    totalDeathsSmoothened = boxFilter(m.days, m.totalDeaths, valid, n=7)
+    deltaDeathsSmoothened = boxFilter(m.days, deltaDeaths, valid, n=7)
+    RSmoothened = boxFilter(m.days, R, valid, n=7)
+
+    for i, country in enumerate(m.countries):
+        entry = db[country]
+        n = int(m.lengths[i])
+        n2 = max(0, n - 14)
+
+        entry.deltaCases = toArray(deltaCases[i], n)
+        entry.deltaDeaths = toArray(deltaDeaths[i], n)
+        entry.totalCases2 = toArray(totalCases2[i], n2)
+        entry.attributableWeight = toArray(weights[i], n)
+        entry.estimatedR = toArray(R[i], n)
+
+        entry.totalCasesSmoothened = toArray(totalCasesSmoothened[i], n)
+        entry.totalCases2Smoothened = toArray(totalCases2Smoothened[i], n2)
+        entry.deltaCasesSmoothened = toArray(deltaCasesSmoothened[i], n)
+        entry.totalDeathsSmoothened = toArray(totalDeathsSmoothened[i], n)
+        entry.deltaDeathsSmoothened = toArray(deltaDeathsSmoothened[i], n)
+        entry.estimatedRSmoothened = toArray(RSmoothened[i], n)
+
+def sweepEstimatedR(m, kernels, smoothen=True, maxChunkBytes=256*2**20):
+    """Compute the estimated R of all countries for many kernels at once.
+
+    `m` is the CaseMatrix of a database and `kernels` is a list of
+    `(weightsList, weightsOffset)` tuples. This returns a dictionary
+    with the (kernels x countries x days) arrays "estimatedR" and,
+    if `smoothen` is true, "estimatedRSmoothened". For each kernel,
+    the results are the same as those of computeDerivedSeries().
+
+    The attributable weights of all kernels are computed in a single
+    pass over the shifts covered by any of them: at each shift, the
+    delta matrix is scaled by the tap of each kernel (which is zero if
+    the kernel does not cover this shift). To bound the memory used,
+    the kernels are processed in chunks.
+    """
+    numCountries, numDays = m.totalCases.shape
+    deltaCases = deltas(m.totalCases)
+    valid = m.validMask()
+
+    estimatedRs = np.full((len(kernels), numCountries, numDays), np.nan)
+    if smoothen:
+        estimatedRsSmoothened = np.full_like(estimatedRs, np.nan)
+
+    chunkSize = max(1, maxChunkBytes // max(1, 8*numCountries*numDays))
+    for c0 in range(0, len(kernels), chunkSize):
+        chunk = kernels[c0:c0 + chunkSize]
+
+        # the taps of all kernels of the chunk, indexed by their shift
+        minShift = min(offset for w, offset in chunk)
+        maxShift = max(offset + len(w) - 1 for w, offset in chunk)
+        taps = np.zeros((len(chunk), maxShift - minShift + 1))
+        for i, (w, offset) in enumerate(chunk):
+            taps[i, offset - minShift:offset - minShift + len(w)] = w
+
+        # the shifts are processed in descending order, so that the
+        # contributions are summed up in the same order as in
+        # attributableWeights()
+        weights = np.zeros((len(chunk), numCountries, numDays))
+        for shift in range(maxShift, minShift - 1, -1):
+            i0 = max(0, -shift)
+            i1 = min(numDays, numDays - shift)
+            if i0 >= i1:
+                continue
+
+            t = taps[:, shift - minShift, np.newaxis, np.newaxis]
+            weights[:, :, i0 + shift:i1 + shift] += t * deltaCases[np.newaxis, :, i0:i1]
+
+        R = estimatedR(m.totalCases[np.newaxis], deltaCases[np.newaxis], weights)
+        estimatedRs[c0:c0 + len(chunk)] = R
+
+        if smoothen:
+            # all kernels and countries are filtered as a single batch
+            numRows = len(chunk)*numCountries
+            RSmoothened = boxFilter(np.tile(m.days, (len(chunk), 1)),
+                                    R.reshape(numRows, numDays),
+                                    np.tile(valid, (len(chunk), 1)),
+                                    n=7)
+            estimatedRsSmoothened[c0:c0 + len(chunk)] = RSmoothened.reshape(len(chunk), numCountries, numDays)
+
+    result = {
+        "countries": m.countries,
+        "lengths": m.lengths,
+        "estimatedR": estimatedRs,
+    }
+    if smoothen:
+        result["estimatedRSmoothened"] = estimatedRsSmoothened
+
+    return result
@@ -0,0 +1,167 @@
+#! /usr/bin/python3
+#
+# A compact binary alternative to the space separated CSV files written
+# by estimateR.printCountryCsv(). The series of a country are stored as
+# little-endian float32 arrays which are simply concatenated, i.e., the
+# file can be used by the dashboard as typed arrays without any
+# parsing. Missing values are NaN. The dates and the offsets of the
+# columns are described by a small JSON index. Since the dates are
+# consecutive except for a few gaps, they are stored as a list of
+# [firstDate, numDays] ranges.
+#
+# The data of all countries can also be written into a single bundle,
+# see writeBundle().
+#
+# Keep in mind that float32 has a precision of about 7 decimal digits,
+# so large total numbers are rounded slightly.
+import os
+import sys
+import json
+import math
+import gzip
+import hashlib
+from array import array
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the series which are exported, in the order in which they are stored
+columnNames = [
+    "totalCases",
+    "deltaCases",
+    "totalDeaths",
+    "deltaDeaths",
+    "estimatedR",
+    "totalCases2",
+    "totalCasesSmoothened",
+    "deltaCasesSmoothened",
+    "totalDeathsSmoothened",
+    "deltaDeathsSmoothened",
+    "estimatedRSmoothened",
+    "totalCases2Smoothened",
+]
+
+def dateRanges(timeList):
+    result = []
+    for i, t in enumerate(timeList):
+        if i > 0 and (t - timeList[i - 1]).days == 1:
+            result[-1][1] += 1
+        else:
+            result.append([t.strftime("%Y-%m-%d"), 1])
+    return result
+
+def encodeCountry(entry):
+    """Encode the series of a database entry.
+
+    This returns the binary data and the JSON-compatible index which
+    describes it. The offsets of the columns are in bytes.
+    """
+    numDays = len(entry["timeList"])
+
+    data = array("f")
+    columns = {}
+    for name in columnNames:
+        columns[name] = data.itemsize*len(data)
+
+        values = entry[name]
+        data.extend(math.nan if x is None else x for x in values)
+        # some series are shorter than the time list
+        data.extend([math.nan]*(numDays - len(values)))
+
+    if sys.byteorder != "little":
+        data.byteswap()
+
+    index = {
+        "dateRanges": dateRanges(entry["timeList"]),
+        "length": numDays,
+        "columns": columns,
+    }
+
+    return data.tobytes(), index
+
+def writeCountryBinary(db, country, outputDir):
+    """Write the files "$COUNTRY.f32" and "$COUNTRY.json" of a country."""
+    if country not in db:
+        return
+
+    data, index = encodeCountry(db[country])
+
+    with open(os.path.join(outputDir, f"{country}.f32"), "wb") as f:
+        f.write(data)
+    with open(os.path.join(outputDir, f"{country}.json"), "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+
+def writeBundle(db, populations, outputDir):
+    """Write the data of all countries into a single content-hashed bundle.
+
+    The bundle consists of the concatenated binary data of all
+    countries ("bundle-$HASH.f32") and an index ("bundle-$HASH.json")
+    which contains the index of each country, the offset of its data
+    within the bundle and its population. Since the names of these
+    files change whenever their contents change, they can be cached
+    indefinitely by web browsers. The names of the current files are
+    specified by the (small) manifest "bundle.json".
+
+    Besides the files themselves, gzip and -- if the brotli module is
+    available -- brotli compressed versions are written, so that web
+    servers can serve them without compressing them on the fly.
+    """
+    chunks = []
+    offset = 0
+    countries = {}
+    for country in sorted(db):
+        data, index = encodeCountry(db[country])
+        index["offset"] = offset
+        index["population"] = populations.get(country)
+        countries[country] = index
+
+        chunks.append(data)
+        offset += len(data)
+
+    data = b"".join(chunks)
+    index = json.dumps({"countries": countries}, separators=(",", ":")).encode()
+
+    h = hashlib.sha1()
+    h.update(data)
+    h.update(index)
+    bundleName = "bundle-" + h.hexdigest()[:16]
+
+    for suffix, contents in [(".f32", data), (".json", index)]:
+        fileName = os.path.join(outputDir, bundleName + suffix)
+        with open(fileName, "wb") as f:
+            f.write(contents)
+        # mtime=0 makes the compressed file depend on the contents only
+        with open(fileName + ".gz", "wb") as f:
+            f.write(gzip.compress(contents, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(fileName + ".br", "wb") as f:
+                f.write(brotli.compress(contents))
+
+    # the manifest is written last, so that clients never see a
+    # manifest which refers to incomplete files
+    manifest = {
+        "index": bundleName + ".json",
+        "data": bundleName + ".f32",
+    }
+    manifestFileName = os.path.join(outputDir, "bundle.json")
+    previousBundleName = None
+    try:
+        with open(manifestFileName) as f:
+            previousBundleName = os.path.splitext(json.load(f)["data"])[0]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    tmpFileName = manifestFileName + ".tmp"
+    with open(tmpFileName, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmpFileName, manifestFileName)
+
+    # the files of older bundles are removed only now. the previous
+    # bundle is kept until the next one is written because clients may
+    # have read the manifest which refers to it just before it was
+    # replaced
+    for fileName in os.listdir(outputDir):
+        if fileName.startswith("bundle-") and fileName.split(".")[0] not in [bundleName, previousBundleName]:
+            os.remove(os.path.join(outputDir, fileName))
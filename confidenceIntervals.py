@@ -0,0 +1,185 @@
+#! /usr/bin/python3
+#
+# Estimate confidence intervals of the estimated R using a parametric
+# bootstrap. For each country, a few thousand replicates of the daily
+# new cases are drawn around the reported ones (Poisson or negative
+# binomial noise) and the parameters of the infectivity kernel are
+# perturbed randomly. R is then computed for all replicates and the
+# lower and upper quantiles over the replicates form the confidence
+# interval of each day.
+#
+# The replicates of a country are stacked into the rows of a matrix
+# and are processed by the batched functions of caseMatrix.py, i.e.,
+# there is no Python loop over the replicates. Replicates with the
+# same kernel parameters are processed together. The countries are
+# distributed over a pool of processes.
+#
+# Keep in mind that this only covers the statistical noise of the case
+# numbers and the uncertainty of the kernel, not systematic errors of
+# the reported data.
+#
+# This module requires NumPy.
+import os
+import zlib
+from array import array
+
+import numpy as np
+
+import estimateR
+import caseMatrix
+
+# the names of the series which are added to the database entries
+lowerUpperNames = {
+    "estimatedR": ("estimatedRLower", "estimatedRUpper"),
+    "estimatedRSmoothened": ("estimatedRSmoothenedLower", "estimatedRSmoothenedUpper"),
+}
+
+def sampleNewCases(rng, deltaCases, numReplicates, noise, dispersion):
+    """Draw replicates of the daily new cases of a country.
+
+    The result is a (replicates x days) matrix. For negative binomial
+    noise, the variance of the number of cases `x` of a day is `x +
+    x**2/dispersion`, i.e., smaller values of `dispersion` mean more
+    noise.
+    """
+    mean = np.broadcast_to(np.maximum(deltaCases, 0), (numReplicates, len(deltaCases)))
+    if noise == "poisson":
+        return rng.poisson(mean).astype(np.float64)
+    elif noise == "negative-binomial":
+        return rng.negative_binomial(dispersion, dispersion/(dispersion + mean)).astype(np.float64)
+    raise ValueError(f"Unknown noise model '{noise}'")
+
+def sampleKernelParameters(rng, numReplicates, kernelJitter):
+    """Draw a (numDaysInfectious, weightsOffset, k) triple for each replicate.
+
+    Each parameter is shifted by a random integer in `[-kernelJitter,
+    kernelJitter]` relative to the defaults of estimateR.py.
+    """
+    shifts = rng.integers(-kernelJitter, kernelJitter + 1, size=(numReplicates, 3))
+    params = np.array([estimateR.numDaysInfectious, estimateR.weightsOffset, estimateR.k]) + shifts
+    params[:, 0] = np.maximum(params[:, 0], 1)
+    params[:, 2] = np.clip(params[:, 2], 0, params[:, 0])
+    return params
+
+def smoothen(days, R, n=7):
+    """Apply the box filter of estimateR.py to all replicates of a country.
+
+    This is a variant of caseMatrix.boxFilter() for rows which share
+    their dates: the boundaries of the windows only need to be
+    determined once.
+    """
+    j0 = np.searchsorted(days, days - n + 1, side="left")
+    j1 = np.searchsorted(days, days, side="right")
+
+    present = ~np.isnan(R)
+    sums = np.zeros((R.shape[0], R.shape[1] + 1))
+    np.cumsum(np.where(present, R, 0.0), axis=1, out=sums[:, 1:])
+    counts = np.zeros((R.shape[0], R.shape[1] + 1), dtype=np.int64)
+    np.cumsum(present, axis=1, out=counts[:, 1:])
+
+    numValues = counts[:, j1] - counts[:, j0]
+    result = np.full(R.shape, np.nan)
+    mask = numValues > 0
+    result[mask] = (sums[:, j1] - sums[:, j0])[mask]/numValues[mask]
+    return result
+
+def quantiles(values, qs):
+    """Compute quantiles over the replicates (i.e., the rows), ignoring NaN values.
+
+    This gives the same results as `np.nanquantile(values, qs, axis=0)`,
+    but it is much faster for many columns because it works on the
+    whole matrix at once.
+    """
+    numValid = (~np.isnan(values)).sum(axis=0)
+    # NaN values are sorted behind all others
+    sortedValues = np.sort(values, axis=0)
+
+    result = []
+    for q in qs:
+        pos = q*np.maximum(numValid - 1, 0)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        a = np.take_along_axis(sortedValues, lo[np.newaxis], axis=0)[0]
+        b = np.take_along_axis(sortedValues, hi[np.newaxis], axis=0)[0]
+        r = a + (b - a)*(pos - lo)
+        r[numValid == 0] = np.nan
+        result.append(r)
+    return result
+
+def bootstrapCountry(task):
+    """Compute the confidence intervals of a single country.
+
+    `task` is a tuple of the total cases, the new cases and the date
+    ordinals of the country, the seed of its random numbers and the
+    bootstrap settings. This returns a dictionary which maps the names
+    of the series to add to their values.
+    """
+    totalCases, deltaCases, days, seed, (numReplicates, noise, dispersion, kernelJitter, qs) = task
+    numDays = len(totalCases)
+    rng = np.random.default_rng(seed)
+
+    newCases = sampleNewCases(rng, deltaCases, numReplicates, noise, dispersion)
+    params = sampleKernelParameters(rng, numReplicates, kernelJitter)
+
+    R = np.full((numReplicates, numDays), np.nan)
+    kernels, kernelIdx = np.unique(params, axis=0, return_inverse=True)
+    kernelIdx = kernelIdx.reshape(-1)
+    for i, (n, offset, k) in enumerate(kernels):
+        rows = np.flatnonzero(kernelIdx == i)
+        weights = caseMatrix.attributableWeights(newCases[rows],
+                                                 estimateR.infectivityWeights(int(n), int(k)),
+                                                 int(offset))
+        R[rows] = caseMatrix.estimatedR(totalCases[np.newaxis], newCases[rows], weights)
+
+    RSmoothened = smoothen(days, R)
+
+    result = {}
+    for name, values in [("estimatedR", R), ("estimatedRSmoothened", RSmoothened)]:
+        lower, upper = quantiles(values, qs)
+        result[lowerUpperNames[name][0]] = lower
+        result[lowerUpperNames[name][1]] = upper
+
+    return result
+
+def computeConfidenceIntervals(db, numReplicates=1000, noise="poisson", dispersion=10.0, kernelJitter=2,
+                               levels=(0.025, 0.975), numProcesses=1, seed=1):
+    """Add the confidence intervals of the estimated R to all countries of a database.
+
+    The derived series of the countries must already have been
+    computed. `levels` are the quantiles which form the lower and the
+    upper bounds of the intervals. The results are reproducible for a
+    given seed, independent of the number of processes and of the
+    other countries of the database.
+    """
+    countries = list(db)
+    # the entries are looked up in advance because the tasks are
+    # generated by a separate thread of the process pool
+    entries = [db[country] for country in countries]
+    # the random numbers of a country do not depend on the other countries
+    seeds = [np.random.SeedSequence([seed, zlib.crc32(country.encode())]) for country in countries]
+    settings = (numReplicates, noise, dispersion, kernelJitter, tuple(levels))
+
+    def tasks():
+        axisDays = {}
+        for entry, countrySeed in zip(entries, seeds):
+            dateAxis = entry.dateAxis
+            if id(dateAxis) not in axisDays:
+                axisDays[id(dateAxis)] = np.array([t.toordinal() for t in dateAxis], dtype=np.int64)
+            days = axisDays[id(dateAxis)][np.frombuffer(entry.dayIndices, dtype=np.intc)]
+            yield (np.frombuffer(entry.totalCases).copy(),
+                   np.frombuffer(entry.deltaCases).copy(),
+                   days,
+                   countrySeed,
+                   settings)
+
+    def store(results):
+        for entry, result in zip(entries, results):
+            for name, values in result.items():
+                setattr(entry, name, array("d", values.tobytes()))
+
+    if numProcesses == 1 or len(countries) < 2:
+        store(map(bootstrapCountry, tasks()))
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(numProcesses or os.cpu_count()) as pool:
+            store(pool.imap(bootstrapCountry, tasks()))
@@ -0,0 +1,96 @@
+#! /usr/bin/python3
+#
+# Normalization of the country names used by the daily reports of
+# Johns Hopkins University. Some countries have weird names and the
+# names are not unique over time, so this maps all names to a single
+# canonical one. Overseas territories and the like are attributed to
+# the country they belong to.
+#
+# Only exact matches are considered, i.e., "US" does not match within
+# other names. Names which are not listed are normalized by a few
+# fallback rules and looked up again (see correctCountryName()).
+import re
+import functools
+
+countryAliases = {
+    'Korea, South': "South Korea",
+    'Republic of Korea': "South Korea",
+    'Taiwan*': "Taiwan",
+    "Taipei and environs": "Taiwan",
+
+    "Iran (Islamic Republic of)": "Iran",
+    "occupied Palestinian territory": "West Bank and Gaza",
+    "Palestine": "West Bank and Gaza",
+    "Republic of Ireland": "Ireland",
+    "Republic of Moldova": "Moldova",
+    "Republic of Congo": "Congo (Brazzaville)",
+    "Republic of the Congo": "Congo (Brazzaville)",
+    "Czech Republic": "Czechia",
+    "East Timor": "Timor-Leste",
+    "Cape Verde": "Cabo Verde",
+    "Vatican City": "Holy See",
+    "Viet Nam": "Vietnam",
+    "UK": "United Kingdom",
+    "The Gambia": "Gambia",
+    "The Bahamas": "Bahamas",
+    "Russian Federation": "Russia",
+    "Ivory Coast": "Cote d'Ivoire",
+
+    'Mainland China': "China",
+    "Hong Kong SAR": "China",
+    "Hong Kong": "China",
+    "Macao SAR": "China",
+    "Macau": "China",
+
+    "US": "United States of America",
+    "Puerto Rico": "United States of America",
+    "Guam": "United States of America",
+
+    "North Ireland": "United Kingdom",
+    "Gibraltar": "United Kingdom",
+    "Cayman Islands": "United Kingdom",
+    "Channel Islands": "United Kingdom",
+    "Jersey": "United Kingdom",
+    "Guernsey": "United Kingdom",
+
+    "Martinique": "France",
+    "Guadeloupe": "France",
+    "French Guiana": "France",
+    "St. Martin": "France",
+    "Saint Martin": "France",
+    "Saint Barthelemy": "France",
+    "Reunion": "France",
+    "Mayotte": "France",
+
+    "Greenland": "Denmark",
+    "Faroe Islands": "Denmark",
+
+    "Aruba": "Netherlands",
+    "Curacao": "Netherlands",
+
+    "Cruise Ship": "Diamond Princess",
+}
+
+def normalizeSpelling(country):
+    # some names are sometimes spelled with surplus whitespace, e.g.
+    # " Azerbaijan"
+    return re.sub(r"\s+", " ", country).strip()
+
+# the rules which are tried in order if a name is not listed in the
+# alias table. each rule maps a name to a possibly different name.
+fallbackRules = [
+    normalizeSpelling,
+]
+
+# the number of distinct names is small, so all results are memoized
+@functools.lru_cache(maxsize=None)
+def correctCountryName(country):
+    if country in countryAliases:
+        return countryAliases[country]
+
+    for rule in fallbackRules:
+        country = rule(country)
+        if country in countryAliases:
+            return countryAliases[country]
+
+    return country
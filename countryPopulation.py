@@ -1,18 +1,28 @@
 #! /usr/bin/python3
-
+#
+# Print the population of a country as listed in
+# "country-populations.csv".
 import sys
 
-countryDict = {}
+def readCountryPopulations(fileName="country-populations.csv"):
+    """Return a dictionary which maps country names to their populations."""
+    countryDict = {}
+
+    with open(fileName) as f:
+        for curLine in f:
+            fields = curLine.split(",")
+
+            # the file specifies the populations in thousands
+            countryDict[fields[0]] = float(fields[1])*1000
 
-country = sys.argv[1]
+    return countryDict
 
-f = open("country-populations.csv")
-for curLine in f.readlines():
-    fields = curLine.split(",")
+if __name__ == "__main__":
+    country = sys.argv[1]
 
-    countryDict[fields[0]] = float(fields[1])*1000
+    countryDict = readCountryPopulations()
 
-if country in countryDict:
-    print("{}".format(countryDict[country]))
-else:
-    print("\"\"")
+    if country in countryDict:
+        print("{}".format(countryDict[country]))
+    else:
+        print("\"\"")
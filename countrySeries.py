@@ -0,0 +1,151 @@
+#! /usr/bin/python3
+#
+# A compact representation of the time series of a country. Instead of
+# a dictionary of Python lists, the series are stored as arrays of
+# doubles, i.e., they need 8 bytes per value instead of a pointer plus
+# a boxed int or float object. Missing values are NaN. The dates are
+# not stored per country: all countries share a list of the dates of
+# the daily reports (the "date axis") and each country only stores the
+# positions of its data points on this axis.
+#
+# For compatibility, the series can still be accessed like the
+# dictionary entries of the past, e.g. `entry["estimatedR"]` returns a
+# list where missing values are None. Such lists are created on every
+# access, so code which processes a lot of data should use the arrays
+# (e.g. `entry.estimatedR`) directly.
+import math
+import bisect
+from array import array
+
+# the names of all series which can be stored for a country
+seriesNames = [
+    "totalCases",
+    "totalDeaths",
+    "deltaCases",
+    "deltaDeaths",
+    "totalCases2",
+    "attributableWeight",
+    "estimatedR",
+    "totalCasesSmoothened",
+    "totalCases2Smoothened",
+    "deltaCasesSmoothened",
+    "totalDeathsSmoothened",
+    "deltaDeathsSmoothened",
+    "estimatedRSmoothened",
+    # the confidence intervals of the estimated R, see
+    # confidenceIntervals.py. these are optional
+    "estimatedRLower",
+    "estimatedRUpper",
+    "estimatedRSmoothenedLower",
+    "estimatedRSmoothenedUpper",
+]
+
+# series which contain numbers of people. their integral values are
+# returned as int by the compatibility view, i.e., they are printed
+# like the numbers of the daily reports.
+countSeriesNames = {
+    "totalCases",
+    "totalDeaths",
+    "deltaCases",
+    "deltaDeaths",
+}
+
+# series which are not numbers of people, i.e., which must not be
+# scaled by the population of a country
+ratioSeriesNames = {
+    "estimatedR",
+    "estimatedRSmoothened",
+    "estimatedRLower",
+    "estimatedRUpper",
+    "estimatedRSmoothenedLower",
+    "estimatedRSmoothenedUpper",
+}
+
+# series which accumulate the numbers of all previous days, i.e., whose
+# values must not be summed up over several days
+cumulativeSeriesNames = {
+    "totalCases",
+    "totalDeaths",
+    "totalCases2",
+    "totalCasesSmoothened",
+    "totalCases2Smoothened",
+    "totalDeathsSmoothened",
+}
+
+def toArray(values):
+    """Convert a sequence of numbers which may contain None to an array of doubles."""
+    if isinstance(values, array) and values.typecode == "d":
+        return values
+    return array("d", (math.nan if x is None else x for x in values))
+
+class CountrySeries:
+    __slots__ = ["dateAxis", "dayIndices"] + seriesNames
+
+    def __init__(self, dateAxis):
+        # the list of dates shared by all countries and the indices of
+        # the data points of this country within it
+        self.dateAxis = dateAxis
+        self.dayIndices = array("i")
+
+        for name in seriesNames:
+            setattr(self, name, None)
+        self.totalCases = array("d")
+        self.totalDeaths = array("d")
+
+    def __len__(self):
+        return len(self.dayIndices)
+
+    def append(self, dayIndex, numCases, numDeaths):
+        """Add the total numbers of a day. The days must be added in chronological order."""
+        self.dayIndices.append(dayIndex)
+        self.totalCases.append(numCases)
+        self.totalDeaths.append(numDeaths)
+
+    def dateIndex(self, dt):
+        """Return the index of the data point of a date. Raises ValueError if there is none."""
+        i = bisect.bisect_left(self.dayIndices, bisect.bisect_left(self.dateAxis, dt))
+        if i == len(self.dayIndices) or self.dateAxis[self.dayIndices[i]] != dt:
+            raise ValueError(f"No data available for {dt}")
+        return i
+
+    def indexRange(self, first=None, last=None):
+        """Return the range `[i0, i1)` of the data points between two dates.
+
+        Both dates are inclusive. If one of them is None, the range is
+        not limited in this direction.
+        """
+        i0 = 0
+        i1 = len(self.dayIndices)
+        if first is not None:
+            i0 = bisect.bisect_left(self.dayIndices, bisect.bisect_left(self.dateAxis, first))
+        if last is not None:
+            i1 = bisect.bisect_right(self.dayIndices, bisect.bisect_right(self.dateAxis, last) - 1)
+        return i0, max(i0, i1)
+
+    def clearDerivedSeries(self):
+        """Drop all series except for the total numbers."""
+        for name in seriesNames:
+            if name not in ["totalCases", "totalDeaths"]:
+                setattr(self, name, None)
+
+    def timeList(self):
+        return [self.dateAxis[i] for i in self.dayIndices]
+
+    def __contains__(self, name):
+        return name == "timeList" or (name in seriesNames and getattr(self, name) is not None)
+
+    def __getitem__(self, name):
+        if name == "timeList":
+            return self.timeList()
+        if name not in self:
+            raise KeyError(name)
+
+        values = getattr(self, name)
+        if name in countSeriesNames:
+            return [int(x) if x.is_integer() else x for x in values]
+        return [None if math.isnan(x) else x for x in values]
+
+    def __setitem__(self, name, values):
+        if name not in seriesNames:
+            raise KeyError(name)
+        setattr(self, name, toArray(values))
@@ -22,8 +22,71 @@ var autoRangeY = null;
 var nextCountryColorIdx = 0;
 // the color indices of countries which have already been added
 var countryColorIndices = {};
+// the countries which are currently selected. their data may still be
+// on its way, so it must be dropped when it arrives after the country
+// has been removed again
+var wantedCountries = {};
+
+// the index and the data of the bundle of all countries written by
+// columnarExport.writeBundle(). bundleData is a promise of an
+// ArrayBuffer. Both are null if no bundle is available.
+var bundleIndex = null;
+var bundleData = null;
+
+function fetchOk(url, options = {}) {
+    return fetch(url, options).then(function (response) {
+        if (!response.ok)
+            throw new Error("could not fetch " + url);
+        return response;
+    });
+}
 
 function readCountryList(onComplete = null) {
+    // the manifest is tiny and must always be up to date. the files it
+    // refers to have content-hashed names, so the browser may cache
+    // them indefinitely.
+    fetchOk("processed-data/bundle.json", {cache: "no-cache"})
+        .then(function (response) {
+            return response.json();
+        })
+        .then(function (manifest) {
+            // start loading the data of all countries right away. it
+            // is decoded on demand by addCountry().
+            bundleData = fetchOk("processed-data/" + manifest.data)
+                .then(function (response) {
+                    return response.arrayBuffer();
+                });
+
+            return fetchOk("processed-data/" + manifest.index);
+        })
+        .then(function (response) {
+            return response.json();
+        })
+        .then(function (index) {
+            bundleIndex = index;
+            for (var country in index.countries) {
+                countryNames.push(country);
+                countryPopulation[country] = parseFloat(index.countries[country].population);
+            }
+            return true;
+        })
+        .catch(function () {
+            bundleIndex = null;
+            bundleData = null;
+            return false;
+        })
+        .then(function (haveBundle) {
+            // this is outside of the part handled by catch() above:
+            // only failing to load the bundle must lead to the CSV
+            // file, not an error in onComplete()
+            if (!haveBundle)
+                readCountryListCsv(onComplete);
+            else if (onComplete)
+                onComplete();
+        });
+}
+
+function readCountryListCsv(onComplete = null) {
     var clRawFile = new XMLHttpRequest();
     clRawFile.open("GET", "processed-data/countries.csv?date="+new Date(), false);
     clRawFile.overrideMimeType("text/csv");
@@ -718,12 +781,93 @@ function recalculateCurves() {
     }
 }
 
+// expand the [firstDate, numDays] ranges of the index of a binary
+// country file into the list of dates
+function expandDateRanges(dateRanges) {
+    var result = [];
+    for (var i = 0; i < dateRanges.length; i++) {
+        var d = new Date(dateRanges[i][0] + "T00:00:00Z");
+        for (var j = 0; j < dateRanges[i][1]; j++) {
+            result.push(d.toISOString().slice(0, 10));
+            d.setUTCDate(d.getUTCDate() + 1);
+        }
+    }
+
+    return result;
+}
+
+// create the input data of a country from the binary format written by
+// columnarExport.py, either from the file of a single country or from a
+// bundle. the columns are used in place, i.e., nothing needs to be
+// parsed. (the data is little-endian, which is the byte order used by
+// all platforms relevant for web browsers.)
+function decodeCountryBinary(index, buffer) {
+    // the offset of the country within the buffer is only specified
+    // for bundles
+    var offset = index.offset || 0;
+    var column = function (name) {
+        return new Float32Array(buffer, offset + index.columns[name], index.length);
+    };
+
+    return {
+        dates: expandDateRanges(index.dateRanges),
+
+        totalCases: column("totalCases"),
+        newCases: column("deltaCases"),
+        totalDeaths: column("totalDeaths"),
+        newDeaths: column("deltaDeaths"),
+    };
+}
+
+function setCountryData(country, cd) {
+    if (!(country in wantedCountries))
+        return;
+
+    inputData[country] = cd;
+
+    $("#countrylist option[value='"+country+"']").prop('selected', true);
+    $('#countrylist').trigger('change.select2');
+
+    recalculateCurves();
+    updatePlot();
+}
+
+// load the data of a country and add it to the plot. this returns a
+// promise which is resolved once the data is available.
 function addCountry(country) {
     if (!(country in countryColorIndices)) {
         countryColorIndices[country] = nextCountryColorIdx;
         nextCountryColorIdx += 1;
     }
+    wantedCountries[country] = true;
+
+    if (bundleIndex && country in bundleIndex.countries) {
+        return bundleData
+            .then(function (buffer) {
+                setCountryData(country, decodeCountryBinary(bundleIndex.countries[country], buffer));
+            })
+            .catch(function () {
+                addCountryCsv(country);
+            });
+    }
+
+    // prefer the binary data of the country. if it is not available,
+    // fall back to the CSV file.
+    var url = "processed-data/" + encodeURIComponent(country);
+    return Promise.all([fetchOk(url + ".json", {cache: "no-cache"}),
+                        fetchOk(url + ".f32", {cache: "no-cache"})])
+        .then(function (responses) {
+            return Promise.all([responses[0].json(), responses[1].arrayBuffer()]);
+        })
+        .then(function (results) {
+            setCountryData(country, decodeCountryBinary(results[0], results[1]));
+        })
+        .catch(function () {
+            addCountryCsv(country);
+        });
+}
 
+function addCountryCsv(country) {
     // read in the data for that country
     var rawFile = new XMLHttpRequest();
     rawFile.open("GET", "processed-data/" + country + ".csv?date="+new Date(), false);
@@ -763,12 +907,7 @@ function addCountry(country) {
                             newDeaths: yPointsNewDeaths,
                         };
 
-                        inputData[country] = cd;
-
-                        $("#countrylist option[value='"+country+"']").prop('selected', true);
-
-                        recalculateCurves();
-                        updatePlot();
+                        setCountryData(country, cd);
                     }
                 });
         }
@@ -777,6 +916,7 @@ function addCountry(country) {
 }
 
 function removeCountry(country) {
+    delete wantedCountries[country];
     delete inputData[country];
     delete plotlyCountryData[country];
     updateUrl();
@@ -838,8 +978,14 @@ function initPlot() {
             });
             $('#countrylist').on('select2:select', function (e) {
                 // console.log("select", e.params.data.id);
-                addCountry(e.params.data.id);
-                updateUrl();
+                // the URL lists the countries whose data is
+                // available. (unless the country has been removed
+                // again in the meantime.)
+                var country = e.params.data.id;
+                addCountry(country).then(function () {
+                    if (country in inputData)
+                        updateUrl();
+                });
             });
             $('#countrylist').on('select2:unselect', function (e) {
                 //console.log("unselect", e.params.data.id);
@@ -43,9 +43,10 @@
 #
 # TODO/IDEAS:
 #
-# - Add an estimate of the confidence intervals. This involves getting
-#   a grip on the quality of the input data as well as considering the
-#   total number of cases.
+# - Improve the confidence intervals (see confidenceIntervals.py). So
+#   far, they only cover the statistical noise of the case numbers and
+#   the uncertainty of the kernel parameters. Getting a grip on the
+#   quality of the input data is still to be done.
 # - Add a "political advice" system: Given a level of acceptable risk,
 #   produce a number of whether loosening or tightening restrictions
 #   is advisable. Besides the user input of the allowable risk level
@@ -63,10 +64,24 @@ import os
 import sys
 import re
 import csv
+import argparse
+import json
+import mmap
+import hashlib
+import time
 import datetime
+import collections.abc
 import operator as op
 from functools import reduce
 
+import profiling
+from countryNames import correctCountryName
+from countrySeries import CountrySeries
+
+# the profiler used to instrument the stages of the computation. see
+# profiling.py for how to enable it.
+profiler = profiling.profilerFromEnvironment()
+
 def nChosek(n, k):
     k = min(k, n-k)
     numer = reduce(op.mul, range(n, n-k, -1), 1)
@@ -85,337 +100,829 @@ k = 12 # specify the "center of infectiousness" of new cases w.r.t. the
        # report date. we set this slightly to the future, i.e., larger
        # than the negative weightsOffset [range: [0, 10]]
 
-weightsList = []
-sumWeights = 0.0
-for i in range(0, numDaysInfectious + 1):
-    p = i / float(numDaysInfectious)
+def infectivityWeights(numDaysInfectious, k):
+    """Return the normalized kernel for a given set of parameters.
+
+    The kernel has `numDaysInfectious + 1` entries, the first of which
+    applies to the day `weightsOffset` days after a case is reported.
+    """
+    weightsList = []
+    sumWeights = 0.0
+    for i in range(0, numDaysInfectious + 1):
+        p = i / float(numDaysInfectious)
+
+        # use the binomial distribution. This is not based on any evidence
+        # except for "looks reasonable to me"!
+        weightsList.append(nChosek(numDaysInfectious, k) * p**k * (1 - p)**(numDaysInfectious - k))
+        sumWeights += weightsList[-1]
+
+    # normalize the weights list
+    return list(map(lambda x: x/sumWeights, weightsList))
+
+weightsList = infectivityWeights(numDaysInfectious, k)
+
+def boxFilter(timeList, data, n, offset=0, start=0):
+    """Compute the running average of a time series over n days.
+
+    The window of the i-th data point covers the calendar days from
+    `n - 1 - offset` days before to `offset` days after
+    `timeList[i]`. Days for which no data point is available and
+    `None` values are not considered, i.e., the result is the average
+    of the values which are actually present within the window. If
+    there are none, the result for this data point is `None`.
+
+    The sums over the windows are computed from prefix sums, so the
+    runtime is linear in the length of the series.
+
+    If `start` is specified, only the results for the data points from
+    this index on are returned. They are the same as the corresponding
+    ones for `start=0`.
+    """
+    numPoints = len(data)
+    days = [t.toordinal() for t in timeList[:numPoints]]
+
+    # prefix sums of the values and of the number of values which are
+    # present
+    sums = [0]
+    counts = [0]
+    for x in data:
+        if x is None:
+            sums.append(sums[-1])
+            counts.append(counts[-1])
+        else:
+            sums.append(sums[-1] + x)
+            counts.append(counts[-1] + 1)
 
-    # use the binomial distribution. This is not based on any evidence
-    # except for "looks reasonable to me"!
-    weightsList.append(nChosek(numDaysInfectious, k) * p**k * (1 - p)**(numDaysInfectious - k))
-    sumWeights += weightsList[-1]
+    result = []
+    j0 = 0
+    j1 = 0
+    for i in range(start, numPoints):
+        # the window is [j0, j1). the time list is sorted, so both
+        # boundaries only ever move forward
+        while j0 < numPoints and days[j0] < days[i] - n + 1 + offset:
+            j0 += 1
+        while j1 < numPoints and days[j1] <= days[i] + offset:
+            j1 += 1
+
+        numValues = counts[j1] - counts[j0]
+        if numValues > 0:
+            result.append((sums[j1] - sums[j0])/numValues)
+        else:
+            result.append(None)
 
-# normalize the weights list
-weightsList = list(map(lambda x: x/sumWeights, weightsList))
+    return result
 
-def boxFilter(timeList, data, n, offset=0):
-    result = []
+# the directory containing the daily reports of Johns Hopkins
+# University. it can be changed using the COVID19R_DATA_DIR environment
+# variable or the "--data-dir" option of the scripts.
+dataSourceDir = os.environ.get("COVID19R_DATA_DIR",
+                               "COVID-19/csse_covid_19_data/csse_covid_19_daily_reports")
 
-    # TODO: the data may have gaps or redundancies, i.e., dates where
-    # no data point or multiple data points are available. So far we
-    # just detect and warn about this...
+def fileNameToDateTime(fileName):
+    dt = datetime.datetime.strptime(fileName, '%m-%d-%Y.csv')
+    return dt
 
-    hasGaps = False
-    for i in range(0, len(data)):
-        sumValues = 0
-        numValues = 0
+def listDailyReports(dataDir):
+    """Return the names of the daily report files of a directory in chronological order."""
+    result = []
 
-        j0 = max(0, int(i - n + 1 + offset))
-        j1 = min(len(data), int(i + offset) + 1)
-        for j in range(j0, j1):
-            if data[j] is None:
-                hasGaps = True
+    for root, dirs, files in os.walk(dataDir):
+        for file in files:
+            if not file.endswith(".csv"):
                 continue
 
-            numValues += 1
-            sumValues += data[j]
+            result.append(file)
 
-        dt = timeList[j1 - 1] - timeList[j0]
-        hasGaps = hasGaps or (dt.days + 1 != numValues)
+    result.sort(key=fileNameToDateTime)
+    return result
 
-        if numValues > 0:
-            result.append(sumValues/numValues)
+# the data of these "countries" is not considered
+ignoredCountries = ["Others", "MS Zaandam"]
+
+def parseReportRow(fields, oldFormat):
+    """Interpret a row of a daily report.
+
+    This returns a `(country, province, county, numCases, numDeaths)`
+    tuple, or None if the row is to be ignored. `oldFormat` specifies
+    if the report uses the column layout of the reports before March
+    22, 2020. The names of provinces and counties are empty if they
+    are not specified.
+    """
+    country = fields[3].strip()
+
+    numCases = 0
+    numDeaths = 0
+    if oldFormat:
+        province = fields[0]
+        county = ""
+        if country == "Cruise Ship":
+            country = "Diamond Princess"
+            province = ""
+        elif country == "Grand Princess Cruise Ship":
+            return None # the "grand princess cruise ship" data seems to be attributed to the US, we don't want that
+        elif fields[1] == "Cruise Ship":
+            country = fields[0]
+            province = ""
         else:
-            result.append(None)
+            country = fields[1]
+        if fields[3] != "":
+            numCases = int(fields[3])
+        if fields[4] != "":
+            numDeaths = int(fields[4])
+    else:
+        country = fields[3]
+        province = fields[2]
+        county = fields[1]
+        if fields[7] != "":
+            numCases = int(fields[7])
+        if fields[8] != "":
+            numDeaths = int(fields[8])
+
+    country = correctCountryName(country)
+
+    if country in ignoredCountries:
+        return None
+
+    return country, province.strip(), county.strip(), numCases, numDeaths
+
+def parseDailyReport(filePath):
+    """Read a daily report and accumulate the numbers of each country.
+
+    The result is a dictionary which maps the name of each country to
+    a `[totalCases, totalDeaths]` list and the number of rows of the
+    file. The countries are ordered by their first appearance in the
+    file.
+    """
+    dt = fileNameToDateTime(os.path.basename(filePath))
+
+    result = {}
+    numRows = 0
 
-#    if hasGaps:
-#        print("Warning: Input data seems to have gaps or multiples", file=sys.stderr)
+    format1Date = datetime.datetime(2020, 3, 22)
+    oldFormat = dt < format1Date
 
-    return result
+    with open(filePath, newline="") as f:
+        csv_reader = csv.reader(f, delimiter=",")
+        header = next(csv_reader, None)
+        if header is None:
+            # an empty report. (StopIteration must not escape from here:
+            # it would silently end the map() over the files.)
+            return result, numRows
 
-dataSourceDir = "COVID-19/csse_covid_19_data/csse_covid_19_daily_reports"
+        for fields in csv_reader:
+            numRows += 1
 
-filesList = []
+            row = parseReportRow(fields, oldFormat)
+            if row is None:
+                continue
+            country, province, county, numCases, numDeaths = row
+
+            if country not in result:
+                result[country] = [0, 0]
+
+            result[country][0] += numCases
+            result[country][1] += numDeaths
+
+    return result, numRows
+
+# the columns of the two layouts of the daily reports which are used:
+# the ones which identify the country, the confirmed cases and the deaths
+reportColumns = {
+    True: ((0, 1), 3, 4),
+    False: ((3,), 7, 8),
+}
+
+# the identifying columns of the rows seen so far, as they appear in
+# the files, mapped to the name of the country or to None if the rows
+# are ignored. there is one dictionary per layout
+rawCountryNames = { True: {}, False: {} }
+
+# the number of lookups in rawCountryNames so far and how many of them
+# had to determine the name of the country (i.e., were not found)
+rawCountryNameLookups = { "lookups": 0, "misses": 0 }
+
+def lookupCountry(nameFields, oldFormat):
+    """Determine the country of a row of a daily report from its identifying columns.
+
+    This is done by parseReportRow(), i.e., the quirks of the data are
+    handled in a single place.
+    """
+    nameColumns, casesColumn, deathsColumn = reportColumns[oldFormat]
+    fields = [""]*(deathsColumn + 1)
+    for column, value in zip(nameColumns, nameFields):
+        fields[column] = value.decode()
+
+    row = parseReportRow(fields, oldFormat)
+    return None if row is None else row[0]
+
+def parseDailyReportFast(filePath):
+    """A faster variant of parseDailyReport() which produces the same results.
+
+    The file is memory mapped and the lines are split into fields
+    without decoding them. Only the columns which are used are
+    interpreted, and the country of a row is looked up in a dictionary
+    keyed by the raw bytes of its identifying columns. Lines where one
+    of the used columns is quoted (e.g. "Korea, South") are handed to
+    the csv module. Empty reports and reports which contain quoted
+    fields spanning multiple lines are parsed by parseDailyReport().
+    """
+    if os.path.getsize(filePath) == 0:
+        return parseDailyReport(filePath)
+
+    dt = fileNameToDateTime(os.path.basename(filePath))
+    oldFormat = dt < datetime.datetime(2020, 3, 22)
+    nameColumns, casesColumn, deathsColumn = reportColumns[oldFormat]
+    getNameFields = op.itemgetter(*nameColumns)
+    numSplits = deathsColumn + 1
+    countries = rawCountryNames[oldFormat]
+
+    result = {}
+    numRows = 0
+    numLookups = 0
+    numMisses = 0
+
+    with open(filePath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header = data.readline()
+        for line in iter(data.readline, b""):
+            numRows += 1
+
+            # the columns after the used ones are not split because
+            # some of them (e.g. "Combined_Key") are usually quoted
+            fields = line.split(b",", numSplits)
+
+            quotePos = line.find(b'"')
+            if (quotePos >= 0 and quotePos < len(line) - len(fields[-1])) or len(fields) <= numSplits:
+                # one of the used columns is quoted or the last one
+                # contains the line break: use the csv module
+                if line.count(b'"') % 2 != 0:
+                    # a quoted field which spans multiple lines. the
+                    # line which continues it starts with the quoted
+                    # text, so this is detected here as well
+                    rawCountryNameLookups["lookups"] += numLookups
+                    rawCountryNameLookups["misses"] += numMisses
+                    return parseDailyReport(filePath)
+
+                row = parseReportRow(next(csv.reader([line.decode()])), oldFormat)
+                if row is None:
+                    continue
+                country, province, county, numCases, numDeaths = row
+            else:
+                nameFields = getNameFields(fields)
+                numLookups += 1
+                country = countries.get(nameFields, "")
+                if country == "":
+                    numMisses += 1
+                    country = lookupCountry(nameFields if len(nameColumns) > 1 else (nameFields,), oldFormat)
+                    countries[nameFields] = country
+                if country is None:
+                    continue
 
-for root, dirs, files in os.walk(dataSourceDir):
-    for file in files:
-        if not file.endswith(".csv"):
-            continue
+                # int() accepts bytes as well
+                numCases = int(fields[casesColumn]) if fields[casesColumn] else 0
+                numDeaths = int(fields[deathsColumn]) if fields[deathsColumn] else 0
 
-        filesList.append(file)
+            counts = result.get(country)
+            if counts is None:
+                result[country] = [numCases, numDeaths]
+            else:
+                counts[0] += numCases
+                counts[1] += numDeaths
+
+    rawCountryNameLookups["lookups"] += numLookups
+    rawCountryNameLookups["misses"] += numMisses
+    return result, numRows
+
+# the file used to cache the per-country totals of the daily reports
+# between runs. If this is None, all files are parsed on every run.
+ingestCacheFile = "estimateR-cache.json"
+
+# increase this whenever the way the daily reports are interpreted
+# changes. this invalidates all existing cache files.
+ingestCacheVersion = 3
+
+def hashFile(filePath):
+    h = hashlib.sha1()
+    with open(filePath, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def loadIngestCache(cacheFileName, dataDir):
+    try:
+        with open(cacheFileName) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        # the cache does not exist yet or it is corrupted. in either
+        # case, we need to start from scratch
+        return {}
+
+    if cache.get("version") != ingestCacheVersion or \
+       cache.get("dataSourceDir") != dataDir:
+        return {}
+
+    return cache["files"]
+
+def storeIngestCache(cacheFileName, dataDir, files):
+    # write to a temporary file first, so that an interrupted run
+    # cannot leave a truncated cache behind
+    tmpFileName = cacheFileName + ".tmp"
+    with open(tmpFileName, "w") as f:
+        json.dump({
+            "version": ingestCacheVersion,
+            "dataSourceDir": dataDir,
+            "files": files,
+        }, f)
+    os.replace(tmpFileName, cacheFileName)
+
+# the last day modified by applyErrata(). databases which do not cover
+# this day yet cannot be updated incrementally
+lastErrataDate = datetime.datetime(2022, 5, 21)
+
+def applyErrata(db):
+    """Apply some errata to the raw data.
+
+    The intention is to e.g. smoothen big retrospecive corrections
+    of a country's data to fix obviously errors in the curves.
+    """
+    if "United States of America" in db:
+        usEntry = db["United States of America"]
+
+        # the data for the US is strange on 28-01-2021. We interpolate
+        # the totals between the days before and after.
+        i = usEntry.dateIndex(datetime.datetime(2021, 1, 28))
+        a = usEntry.totalCases[i-1]
+        b = usEntry.totalCases[i+1]
+        usEntry.totalCases[i] = (a+b)/2
+
+        a = usEntry.totalDeaths[i-1]
+        b = usEntry.totalDeaths[i+1]
+        usEntry.totalDeaths[i] = (a+b)/2
+
+    if "United Kingdom" in db:
+        ukEntry = db["United Kingdom"]
+
+        # the UK had a weird spike in the total case and death
+        # numbers of may 20 and may 21, 2022...
+        i = ukEntry.dateIndex(datetime.datetime(2022, 5, 20))
+        ukEntry.totalCases[i] -= 1.926e6
+        ukEntry.totalCases[i + 1] -= 1.926e6
+        #ukEntry.totalDeaths[i] -= 12300
+        #ukEntry.totalDeaths[i + 1] -= 12300
+
+        # the UK had ~ 5000k spurious deaths between April 29th
+        # 2020 and August 16, 2020
+        #i0 = ukEntry.dateIndex(datetime.datetime(2020, 4, 29))
+        #i1 = ukEntry.dateIndex(datetime.datetime(2020, 8, 17))
+        #for i in range(i0, i1):
+        #    ukEntry.totalDeaths[i] -= 4919
+
+def ingestDatabase(cacheFileName=ingestCacheFile, numProcesses=1, dataDir=None):
+    """Read the total numbers of all countries from the daily reports.
+
+    The result maps the name of each country to a CountrySeries object
+    which only contains the "totalCases" and "totalDeaths" series. The
+    errata are already applied to them.
+    """
+    db = {}
 
-def fileNameToDateTime(fileName):
-    dt = datetime.datetime.strptime(fileName, '%m-%d-%Y.csv')
-    return dt
-filesList.sort(key=fileNameToDateTime)
-
-def correctCountryName(country):
-    # some countries have weird names and are not unique over
-    # time, rectify this
-    country = country.replace('Korea, South', "South Korea")
-    country = country.replace('Republic of Korea', "South Korea")
-    country = country.replace('Taiwan*', "Taiwan")
-
-    country = country.replace("Iran (Islamic Republic of)", "Iran")
-    country = country.replace("occupied Palestinian territory", "West Bank and Gaza")
-    country = country.replace("Palestine", "West Bank and Gaza")
-    country = country.replace("Republic of Ireland", "Ireland")
-    country = country.replace("Republic of Moldova", "Moldova")
-    country = country.replace("Republic of Congo", "Congo (Brazzaville)")
-    country = country.replace("Republic of the Congo", "Congo (Brazzaville)")
-    country = country.replace("Czech Republic", "Czechia")
-    country = country.replace("East Timor", "Timor-Leste")
-    country = country.replace(" Azerbaijan", "Azerbaijan")
-    country = country.replace(" Afghanistan", "Afghanistan")
-    country = country.replace("Cape Verde", "Cabo Verde")
-    country = country.replace("Vatican City", "Holy See")
-    country = country.replace("Viet Nam", "Vietnam")
-    country = country.replace("UK", "United Kingdom")
-    country = country.replace("The Gambia", "Gambia")
-    country = country.replace("The Bahamas", "Bahamas")
-    country = country.replace("Taipei and environs", "Taiwan")
-    country = country.replace("Russian Federation", "Russia")
-    country = country.replace("Ivory Coast", "Cote d'Ivoire")
-
-    country = country.replace('Mainland China', "China")
-    country = country.replace("Hong Kong SAR", "China")
-    country = country.replace("Hong Kong", "China")
-    country = country.replace("Macao SAR", "China")
-    country = country.replace("Macau", "China")
-
-    country = country.replace("US", "United States of America")
-    country = country.replace("Puerto Rico", "United States of America")
-    country = country.replace("Guam", "United States of America")
-
-    country = country.replace("North Ireland", "United Kingdom")
-    country = country.replace("Gibraltar", "United Kingdom")
-    country = country.replace("Cayman Islands", "United Kingdom")
-    country = country.replace("Channel Islands", "United Kingdom")
-    country = country.replace("Jersey", "United Kingdom")
-    country = country.replace("Guernsey", "United Kingdom")
-
-    country = country.replace("Martinique", "France")
-    country = country.replace("Guadeloupe", "France")
-    country = country.replace("French Guiana", "France")
-    country = country.replace("St. Martin", "France")
-    country = country.replace("Saint Martin", "France")
-    country = country.replace("Saint Barthelemy", "France")
-    country = country.replace("Reunion", "France")
-    country = country.replace("Mayotte", "France")
-
-    country = country.replace("Greenland", "Denmark")
-    country = country.replace("Faroe Islands", "Denmark")
-
-    country = country.replace("Aruba", "Netherlands")
-    country = country.replace("Curacao", "Netherlands")
-
-    country = country.replace("Cruise Ship", "Diamond Princess")
-
-    return country
-
-def createDatabase():
-    def applyErrata(db):
-        """Apply some errata to the raw data.
-
-        The intention is to e.g. smoothen big retrospecive corrections
-        of a country's data to fix obviously errors in the curves.
-        """
-        if "United States of America" in db:
-            usEntry = db["United States of America"]
-
-            # the data for the US is strange on 28-01-2021. We interpolate
-            # the totals between the days before and after.
-            i = usEntry["timeList"].index(datetime.datetime(2021, 1, 28))
-            a = usEntry["totalCases"][i-1]
-            b = usEntry["totalCases"][i+1]
-            usEntry["totalCases"][i] = (a+b)/2
-
-            a = usEntry["totalDeaths"][i-1]
-            b = usEntry["totalDeaths"][i+1]
-            usEntry["totalDeaths"][i] = (a+b)/2
-
-        if "United Kingdom" in db:
-            ukEntry = db["United Kingdom"]
-
-            # the UK had a weird spike in the total case and death
-            # numbers of may 20 and may 21, 2022...
-            i = ukEntry["timeList"].index(datetime.datetime(2022, 5, 20))
-            ukEntry["totalCases"][i] -= 1.926e6
-            ukEntry["totalCases"][i + 1] -= 1.926e6
-            #ukEntry["totalDeaths"][i] -= 12300
-            #ukEntry["totalDeaths"][i + 1] -= 12300
-
-            # the UK had ~ 5000k spurious deaths between April 29th
-            # 2020 and August 16, 2020
-            #i0 = ukEntry["timeList"].index(datetime.datetime(2020, 4, 29))
-            #i1 = ukEntry["timeList"].index(datetime.datetime(2020, 8, 17))
-            #for i in range(i0, i1):
-            #    ukEntry["totalDeaths"][i] -= 4919
+    with profiler.stage("listFiles"):
+        if dataDir is None:
+            dataDir = dataSourceDir
+        fileNames = listDailyReports(dataDir)
+    profiler.count("files", len(fileNames))
+
+    with profiler.stage("loadCache"):
+        cache = loadIngestCache(cacheFileName, dataDir) if cacheFileName else {}
+
+    with profiler.stage("checkCache"):
+        newCache, filesToParse, cacheChanged = checkIngestCache(cache, dataDir, fileNames)
+    profiler.count("filesParsed", len(filesToParse))
+
+    nameLookups = dict(rawCountryNameLookups)
+    with profiler.stage("parseFiles"):
+        parseFiles(newCache, dataDir, filesToParse, numProcesses)
+    # the lookups of worker processes are not visible here
+    profiler.count("nameLookups", rawCountryNameLookups["lookups"] - nameLookups["lookups"])
+    profiler.count("nameLookupMisses", rawCountryNameLookups["misses"] - nameLookups["misses"])
+    profiler.count("rowsParsed", sum(newCache[fileName]["rows"] for fileName in filesToParse))
+
+    with profiler.stage("merge"):
+        # merge the totals of the individual files in chronological
+        # order. the dates of the files are shared by all countries
+        dateAxis = [fileNameToDateTime(fileName) for fileName in fileNames]
+        for dayIdx, fileName in enumerate(fileNames):
+            for country, (numCases, numDeaths) in newCache[fileName]["countries"].items():
+                if country not in db:
+                    db[country] = CountrySeries(dateAxis)
+
+                db[country].append(dayIdx, numCases, numDeaths)
+    profiler.count("countries", len(db))
+
+    if cacheFileName and (cacheChanged or len(newCache) != len(cache)):
+        with profiler.stage("storeCache"):
+            storeIngestCache(cacheFileName, dataDir, newCache)
+
+    with profiler.stage("errata"):
+        applyErrata(db)
 
-    db = {}
+    return db
 
-    format1Date = datetime.datetime(2020, 3, 22)
+def updateDatabase(db, cacheFileName=ingestCacheFile, dataDir=None):
+    """Add new daily reports to a database produced by createDatabase().
+
+    Only reports for days after the last day of the database can be
+    added this way. The total numbers of the countries are extended
+    and their derived series are recomputed where they may have
+    changed. This returns a dictionary which maps the name of each
+    country that got new data to the index of its first data point
+    whose values may have changed, or None if the database needs to
+    be recreated from scratch, e.g. because an old report was
+    modified.
+    """
+    if not db:
+        return None
+
+    if dataDir is None:
+        dataDir = dataSourceDir
+    fileNames = listDailyReports(dataDir)
+
+    dateAxis = next(iter(db.values())).dateAxis
+    numOldFiles = len(dateAxis)
+    if len(fileNames) < numOldFiles or [fileNameToDateTime(f) for f in fileNames[:numOldFiles]] != dateAxis:
+        return None
+
+    newFileNames = fileNames[numOldFiles:]
+    if newFileNames and fileNameToDateTime(newFileNames[0]) <= lastErrataDate:
+        return None
+
+    cache = loadIngestCache(cacheFileName, dataDir) if cacheFileName else {}
+    newCache, filesToParse, cacheChanged = checkIngestCache(cache, dataDir, fileNames)
+    if any(fileName not in newFileNames for fileName in filesToParse):
+        return None
+
+    parseFiles(newCache, dataDir, filesToParse)
+    if cacheFileName and (cacheChanged or len(newCache) != len(cache)):
+        storeIngestCache(cacheFileName, dataDir, newCache)
+
+    # the new days are appended to the date axis shared by all countries
+    oldLengths = {}
+    for fileName in newFileNames:
+        dateAxis.append(fileNameToDateTime(fileName))
+        for country, (numCases, numDeaths) in newCache[fileName]["countries"].items():
+            if country not in db:
+                db[country] = CountrySeries(dateAxis)
+
+            oldLengths.setdefault(country, len(db[country]))
+            db[country].append(len(dateAxis) - 1, numCases, numDeaths)
+
+    # the new cases of a day are distributed over the previous days
+    # via the kernel, so the derived series change before the new data
+    # points as well. the i-th value of "totalCases2" belongs to the
+    # (i + 14)-th data point but is listed next to the i-th one (see
+    # printCountryCsv()), so the rows of its new values change, too.
+    result = {}
+    for country, n in oldLengths.items():
+        start = max(0, n + min(0, weightsOffset))
+        computeCountrySeries(db[country], start)
+        result[country] = min(start, max(0, n - 14))
 
-    for fileName in filesList:
-        dt = fileNameToDateTime(fileName)
+    return result
 
-        csv_reader = csv.reader(open(dataSourceDir + "/" + fileName).readlines(), delimiter=",")
-        header = next(csv_reader)
-        for fields in csv_reader:
-            country = fields[3].strip()
-
-            numCases = 0
-            numDeaths = 0
-            if dt < format1Date:
-                if country == "Cruise Ship":
-                    country = "Diamond Princess"
-                elif country == "Grand Princess Cruise Ship":
-                    continue # the "grand princess cruise ship" data seems to be attributed to the US, we don't want that
-                elif fields[1] == "Cruise Ship":
-                    country = fields[0]
-                else:
-                    country = fields[1]
-                if fields[3] != "":
-                    numCases = int(fields[3])
-                if fields[4] != "":
-                    numDeaths = int(fields[4])
-            else:
-                country = fields[3]
-                if fields[7] != "":
-                    numCases = int(fields[7])
-                if fields[8] != "":
-                    numDeaths = int(fields[8])
+def computeDerivedSeries(db, engine="python", countries=None):
+    """Compute the derived series like the estimated R of the countries of a database.
+
+    If `countries` is not specified, this is done for all countries.
+    """
+    with profiler.stage("derivedSeries"):
+        if engine == "python":
+            timeCountries = profiler.enabled
+            for country in db if countries is None else countries:
+                if timeCountries:
+                    t0 = time.perf_counter()
+
+                computeCountrySeries(db[country])
+
+                if timeCountries:
+                    profiler.countryTime(country, time.perf_counter() - t0)
+        elif engine == "numpy":
+            # the numpy engine always processes all countries at once
+            import caseMatrix
+            caseMatrix.computeDerivedSeries(db, weightsList, weightsOffset)
+        else:
+            raise ValueError(f"Unknown estimation engine '{engine}'")
 
-            country = correctCountryName(country)
+def createDatabase(cacheFileName=ingestCacheFile, engine="python", numProcesses=1, dataDir=None):
+    """Read the daily reports and compute the derived series of all countries.
 
-            if country in ["Others", "MS Zaandam"]:
-                continue
+    See `Database` for a variant which does the work lazily.
+    """
+    db = ingestDatabase(cacheFileName, numProcesses, dataDir)
+    computeDerivedSeries(db, engine)
+    return db
 
-            if country not in db:
-                db[country] = {
-                    "timeList": [],
-                    "totalCases": [],
-                    "totalDeaths": [],
+def checkIngestCache(cache, dataDir, fileNames):
+    """Determine which daily reports are not covered by the ingestion cache.
+
+    This returns the new cache, the list of files which need to be
+    parsed and whether the cache has been modified. The entries of the
+    files which need to be parsed are incomplete.
+    """
+    cacheChanged = False
+
+    newCache = {}
+    filesToParse = []
+    for fileName in fileNames:
+        # only parse the files which are new or which have been modified
+        # since the last run. the modification time is only used as a
+        # shortcut: if it changed, we compare the hash of the file's
+        # contents before we consider it to be modified.
+        filePath = dataDir + "/" + fileName
+        st = os.stat(filePath)
+        cacheEntry = cache.get(fileName)
+        if cacheEntry is None or \
+           cacheEntry["mtime"] != st.st_mtime_ns or \
+           cacheEntry["size"] != st.st_size:
+            cacheChanged = True
+            fileHash = hashFile(filePath)
+            if cacheEntry is None or cacheEntry["sha1"] != fileHash:
+                cacheEntry = {
+                    "sha1": fileHash,
+                    "countries": None,
                 }
+                filesToParse.append(fileName)
+            cacheEntry["mtime"] = st.st_mtime_ns
+            cacheEntry["size"] = st.st_size
+
+        newCache[fileName] = cacheEntry
+
+    return newCache, filesToParse, cacheChanged
+
+def parseFiles(cache, dataDir, fileNames, numProcesses=1):
+    """Parse daily reports and store the results in the cache entries of the files."""
+    filePaths = [dataDir + "/" + fileName for fileName in fileNames]
+    if numProcesses == 1 or len(filePaths) < 2:
+        results = list(map(parseDailyReportFast, filePaths))
+    else:
+        # the workers only return the per-country totals of each file,
+        # which are tiny compared to the files themselves
+        # multiprocessing is only imported here since importing it
+        # is comparatively slow
+        import multiprocessing
+        numProcesses = numProcesses or os.cpu_count()
+        with multiprocessing.Pool(numProcesses) as pool:
+            chunkSize = max(1, len(filePaths) // (4*numProcesses))
+            results = pool.map(parseDailyReportFast, filePaths, chunkSize)
+
+    for fileName, (countries, numRows) in zip(fileNames, results):
+        cache[fileName]["countries"] = countries
+        cache[fileName]["rows"] = numRows
+
+def computeCountrySeries(entry, start=0):
+    """Compute the derived series of a single country from its total numbers.
+
+    If `start` is specified, the derived series are only recomputed
+    from this data point on and the previous values are kept. This is
+    used if data points have been appended to the total numbers, see
+    updateDatabase().
+    """
+    timeList = entry["timeList"]
+    totalCases = entry["totalCases"]
+    totalDeaths = entry["totalDeaths"]
+
+    def keep(name, n):
+        return entry[name][:max(0, n)] if start > 0 else []
+
+    # the number of daily new cases based on the total cases
+    deltaCases = keep("deltaCases", start)
+    # the number of daily deaths based on the total deaths
+    deltaDeaths = keep("deltaDeaths", start)
+    # number of deaths divided by 0.017 (the lethality on the Diamond
+    # Princess cruise ship)
+    totalCases2 = keep("totalCases2", start - 14)
+    for i in range(start, len(totalCases)):
+        numCases = totalCases[i]
+        if i > 1:
+            # some countries like Spain report a negative number of
+            # new cases on some days, probably due to discovering
+            # errors in data collection (e.g., cases counted multiple
+            # times, etc.). while this is in general not a felony, it
+            # spoils our curves too much, so we don't allow negative
+            # new case numbers...
+            deltaCases.append(max(0, totalCases[i] - totalCases[i - 1]))
+            deltaDeaths.append(max(0, totalDeaths[i] - totalDeaths[i - 1]))
+        else:
+            deltaCases.append(numCases)
+            deltaDeaths.append(totalDeaths[i])
+
+        # death is delayed relative to infection for about three weeks and
+        # relative to confirmation for about 14 days...
+        if i >= 14:
+            totalCases2.append(totalDeaths[i] * (712./13))
+
+    # compute the attributable weight based on the filtered case deltas
+    attributableWeight = keep("attributableWeight", start) + [0.0]*(len(timeList) - start)
+    # the first day whose new cases affect the days from `start` on
+    i0 = max(0, start - weightsOffset - len(weightsList) + 1)
+    for i in range(i0, len(timeList)):
+        # the new cases seen at day i are the ones which we need to
+        # distribute amongst day i's neighbors using the weightList array
+        for j, w in enumerate(weightsList):
+            dayIdx = i + weightsOffset + j
+            if dayIdx < start:
+                continue
+            elif dayIdx + 1 > len(timeList):
+                continue
 
-            if len(db[country]["timeList"]) == 0 or db[country]["timeList"][-1] != dt:
-                db[country]["timeList"].append(dt)
-                db[country]["totalCases"].append(0)
-                db[country]["totalDeaths"].append(0)
-
-            db[country]["totalCases"][-1] += numCases
-            db[country]["totalDeaths"][-1] += numDeaths
-
-    applyErrata(db)
-
-    for country in db:
-        # the number of daily new cases based on the total cases
-        db[country]["deltaCases"] = []
-        # the number of daily deaths based on the total deaths
-        db[country]["deltaDeaths"] = []
-        # number of deaths divided by 0.017 (the lethality on the Diamond
-        # Princess cruise ship)
-        db[country]["totalCases2"] = []
-        for i, numCases in enumerate(db[country]["totalCases"]):
-            if i > 1:
-                # some countries like Spain report a negative number of
-                # new cases on some days, probably due to discovering
-                # errors in data collection (e.g., cases counted multiple
-                # times, etc.). while this is in general not a felony, it
-                # spoils our curves too much, so we don't allow negative
-                # new case numbers...
-                db[country]["deltaCases"].append(max(0, db[country]["totalCases"][i] - db[country]["totalCases"][i - 1]))
-                db[country]["deltaDeaths"].append(max(0, db[country]["totalDeaths"][i] - db[country]["totalDeaths"][i - 1]))
+            attributableWeight[dayIdx] += w * deltaCases[i]
+
+    # the estimated R factor of a given day simply is the ratio between
+    # number of observed cases and the attributable weight of that day.
+    estimatedR = keep("estimatedR", start)
+    for i in range(start, len(deltaCases)):
+        R = None
+        if totalCases[i] >= 100 and attributableWeight[i] > 1e-10:
+            R = deltaCases[i]/attributableWeight[i]
+
+        estimatedR.append(R)
+
+    entry["deltaCases"] = deltaCases
+    entry["deltaDeaths"] = deltaDeaths
+    entry["totalCases2"] = totalCases2
+    entry["attributableWeight"] = attributableWeight
+    entry["estimatedR"] = estimatedR
+
+    # the running averages only depend on the current and the previous
+    # days, i.e., they only change from `start` on as well
+    start2 = max(0, start - 14)
+    entry["totalCasesSmoothened"] = keep("totalCasesSmoothened", start) + boxFilter(timeList, totalCases, n=7, start=start)
+    entry["totalCases2Smoothened"] = keep("totalCases2Smoothened", start2) + boxFilter(timeList, totalCases2, n=7, start=start2)
+    entry["deltaCasesSmoothened"] = keep("deltaCasesSmoothened", start) + boxFilter(timeList, deltaCases, n=7, start=start)
+    entry["totalDeathsSmoothened"] = keep("totalDeathsSmoothened", start) + boxFilter(timeList, totalDeaths, 7, start=start)
+    entry["deltaDeathsSmoothened"] = keep("deltaDeathsSmoothened", start) + boxFilter(timeList, deltaDeaths, 7, start=start)
+    entry["estimatedRSmoothened"] = keep("estimatedRSmoothened", start) + boxFilter(timeList, estimatedR, 7, start=start)
+
+class Database(collections.abc.Mapping):
+    """A lazily built database of all countries.
+
+    This behaves like the dictionary returned by `createDatabase()`,
+    but the daily reports are only read once the database is accessed
+    for the first time, and the derived series of a country are only
+    computed once the country is looked up. Both are memoized. Listing
+    the countries or checking if a country exists thus does not
+    involve computing any estimates.
+    """
+
+    def __init__(self, dataDir=None, cacheFileName=ingestCacheFile, engine="python", numProcesses=1):
+        if engine not in ["python", "numpy"]:
+            raise ValueError(f"Unknown estimation engine '{engine}'")
+
+        self.dataDir = dataDir
+        self.cacheFileName = cacheFileName
+        self.engine = engine
+        self.numProcesses = numProcesses
+
+        self._rawData = None
+        self._computed = set()
+
+    def rawData(self):
+        """Return the dictionary of the total numbers, reading the daily reports if necessary.
+
+        The entries of countries which have already been looked up also
+        contain the derived series.
+        """
+        if self._rawData is None:
+            self._rawData = ingestDatabase(self.cacheFileName, self.numProcesses, self.dataDir)
+        return self._rawData
+
+    def __getitem__(self, country):
+        db = self.rawData()
+        entry = db[country]
+
+        if country not in self._computed:
+            if self.engine == "numpy":
+                computeDerivedSeries(db, "numpy")
+                self._computed.update(db)
             else:
-                db[country]["deltaCases"].append(numCases)
-                db[country]["deltaDeaths"].append(db[country]["totalDeaths"][i])
-
-            # death is delayed relative to infection for about three weeks and
-            # relative to confirmation for about 14 days...
-            if i >= 14:
-                db[country]["totalCases2"].append(db[country]["totalDeaths"][i] * (712./13))
-
-        # compute the attributable weight based on the filtered case deltas
-        db[country]["attributableWeight"] = [0.0]*len(db[country]["timeList"])
-        for i in range(0, len(db[country]["timeList"])):
-            # the new cases seen at day i are the ones which we need to
-            # distribute amongst day i's neighbors using the weightList array
-            for j, w in enumerate(weightsList):
-                dayIdx = i + weightsOffset + j
-                if dayIdx < 0:
-                    continue
-                elif dayIdx + 1 > len(db[country]["timeList"]):
-                    continue
+                computeDerivedSeries(db, "python", [country])
+                self._computed.add(country)
 
-                db[country]["attributableWeight"][dayIdx] += w * db[country]["deltaCases"][i]
+        return entry
 
-        # the estimated R factor of a given day simply is the ratio between
-        # number of observed cases and the attributable weight of that day.
-        db[country]["estimatedR"] = []
-        for i, n in enumerate(db[country]["deltaCases"]):
-            R = None
-            if db[country]["totalCases"][i] >= 100 and db[country]["attributableWeight"][i] > 1e-10:
-                R = db[country]["deltaCases"][i]/db[country]["attributableWeight"][i]
+    def __contains__(self, country):
+        return country in self.rawData()
 
-            db[country]["estimatedR"].append(R)
+    def __iter__(self):
+        return iter(self.rawData())
 
-        db[country]["totalCasesSmoothened"] = boxFilter(db[country]["timeList"], db[country]["totalCases"], n=7)
-        db[country]["totalCases2Smoothened"] = boxFilter(db[country]["timeList"], db[country]["totalCases2"], n=7)
-        db[country]["deltaCasesSmoothened"] = boxFilter(db[country]["timeList"], db[country]["deltaCases"], n=7)
-        db[country]["totalDeathsSmoothened"] = boxFilter(db[country]["timeList"], db[country]["totalDeaths"], 7)
-        db[country]["deltaDeathsSmoothened"] = boxFilter(db[country]["timeList"], db[country]["deltaDeaths"], 7)
-        db[country]["estimatedRSmoothened"] = boxFilter(db[country]["timeList"], db[country]["estimatedR"], 7)
+    def __len__(self):
+        return len(self.rawData())
 
-    return db
 
-def printCountryCsv(db, country, outFile):
+def printCountryCsv(db, country, outFile, firstRow=0):
+    """Print the results for a country.
+
+    If `firstRow` is specified, only the data points from this index on
+    are printed and the header is omitted.
+    """
     if country not in db:
         return
 
     # print the results
-    print('Date '+ \
-          '"Total Cases" '+ \
-          '"New Cases" '+ \
-          '"Total Deaths" '+ \
-          '"New Deaths" '+ \
-          '"Estimated R" '+ \
-          '"\'Diamond Princess Total Case Estimate\'" '+ \
-          '"Smoothened Total Cases" '+ \
-          '"Smoothened New Cases" '+ \
-          '"Smoothened Total Deaths" '+ \
-          '"Smoothened New Deaths" '+ \
-          '"Smoothened Estimated R" '+ \
-          '"Smoothened \'Diamond Princess Total Case Estimate\'" ',
-          file=outFile)
-    for i in range(0, len(db[country]["timeList"])):
+    if firstRow == 0:
+        print('Date '+ \
+              '"Total Cases" '+ \
+              '"New Cases" '+ \
+              '"Total Deaths" '+ \
+              '"New Deaths" '+ \
+              '"Estimated R" '+ \
+              '"\'Diamond Princess Total Case Estimate\'" '+ \
+              '"Smoothened Total Cases" '+ \
+              '"Smoothened New Cases" '+ \
+              '"Smoothened Total Deaths" '+ \
+              '"Smoothened New Deaths" '+ \
+              '"Smoothened Estimated R" '+ \
+              '"Smoothened \'Diamond Princess Total Case Estimate\'" '+ \
+              ('"Estimated R Lower" '+ \
+               '"Estimated R Upper" '+ \
+               '"Smoothened Estimated R Lower" '+ \
+               '"Smoothened Estimated R Upper" ' if "estimatedRLower" in db[country] else ''),
+              file=outFile)
+
+    # the series are looked up only once because the compatibility
+    # view of the country record creates a new list for each access
+    entry = db[country]
+    timeList = entry["timeList"]
+    totalCases = entry["totalCases"]
+    deltaCases = entry["deltaCases"]
+    totalDeaths = entry["totalDeaths"]
+    deltaDeaths = entry["deltaDeaths"]
+    estimatedR = entry["estimatedR"]
+    totalCases2 = entry["totalCases2"]
+    totalCasesSmoothened = entry["totalCasesSmoothened"]
+    deltaCasesSmoothened = entry["deltaCasesSmoothened"]
+    estimatedRSmoothened = entry["estimatedRSmoothened"]
+    totalCases2Smoothened = entry["totalCases2Smoothened"]
+    # the confidence intervals are optional
+    intervals = None
+    if "estimatedRLower" in entry:
+        intervals = [entry[name] for name in ["estimatedRLower",
+                                              "estimatedRUpper",
+                                              "estimatedRSmoothenedLower",
+                                              "estimatedRSmoothenedUpper"]]
+    for i in range(firstRow, len(timeList)):
         tc2 =  "\"\""
         tc2s = "\"\""
-        if i < len(db[country]["totalCases2"]):
-            tc2 = db[country]["totalCases2"][i]
-            tc2s = db[country]["totalCases2Smoothened"][i]
-
-        R = "\"\"" if db[country]["estimatedR"][i] is None else db[country]["estimatedR"][i]
-        Rs = "\"\"" if db[country]["estimatedRSmoothened"][i] is None else db[country]["estimatedRSmoothened"][i]
-        print(f'{db[country]["timeList"][i].strftime("%Y-%m-%d")}' + \
-              f' {db[country]["totalCases"][i]}'+ \
-              f' {db[country]["deltaCases"][i]}'+ \
-              f' {db[country]["totalDeaths"][i]}'+ \
-              f' {db[country]["deltaDeaths"][i]}'+ \
+        if i < len(totalCases2):
+            tc2 = totalCases2[i]
+            tc2s = totalCases2Smoothened[i]
+
+        R = "\"\"" if estimatedR[i] is None else estimatedR[i]
+        Rs = "\"\"" if estimatedRSmoothened[i] is None else estimatedRSmoothened[i]
+        print(f'{timeList[i].strftime("%Y-%m-%d")}' + \
+              f' {totalCases[i]}'+ \
+              f' {deltaCases[i]}'+ \
+              f' {totalDeaths[i]}'+ \
+              f' {deltaDeaths[i]}'+ \
               f' {R}'+ \
               f' {tc2}'+ \
-              f' {db[country]["totalCasesSmoothened"][i]}'+ \
-              f' {db[country]["deltaCasesSmoothened"][i]}'+ \
-              f' {db[country]["totalDeaths"][i]}'+ \
-              f' {db[country]["deltaDeaths"][i]}'+ \
+              f' {totalCasesSmoothened[i]}'+ \
+              f' {deltaCasesSmoothened[i]}'+ \
+              f' {totalDeaths[i]}'+ \
+              f' {deltaDeaths[i]}'+ \
               f' {Rs}'+ \
-              f' {tc2s}', file=outFile)
+              f' {tc2s}'+ \
+              ('' if intervals is None else
+               ''.join(' ""' if values[i] is None else f' {values[i]}' for values in intervals)),
+              file=outFile)
 
 if __name__ == "__main__":
-    country = "Germany"
-    if len(sys.argv) > 1:
-        country = sys.argv[1]
-
-    db = createDatabase()
-
-    printCountryCsv(db, country, sys.stdout)
-
+    parser = argparse.ArgumentParser(description="Estimate the effective reproduction number R of a country.")
+    parser.add_argument("country", nargs="?", default="Germany",
+                        help="the name of the country to print the results for")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python",
+                        help="the implementation used to compute the derived series")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="the number of processes used to parse the daily reports. 0 means one per CPU")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="estimate confidence intervals of R using N bootstrap replicates. requires NumPy")
+    parser.add_argument("--noise", choices=["poisson", "negative-binomial"], default="poisson",
+                        help="the noise model of the daily new cases used for the bootstrap")
+    parser.add_argument("--data-dir", default=dataSourceDir,
+                        help="the directory containing the daily reports")
+    profiling.addArguments(parser)
+    args = parser.parse_args()
+
+    profiler = profiling.profilerFromArguments(args, profiler)
+
+    db = Database(dataDir=args.data_dir, engine=args.engine, numProcesses=args.jobs or None)
+
+    if args.bootstrap > 0 and args.country in db:
+        import confidenceIntervals
+        with profiler.stage("confidenceIntervals"):
+            confidenceIntervals.computeConfidenceIntervals({args.country: db[args.country]},
+                                                           numReplicates=args.bootstrap,
+                                                           noise=args.noise)
+
+    with profiler.stage("output"):
+        printCountryCsv(db, args.country, sys.stdout)
+
+    profiler.writeReport(args.profile)
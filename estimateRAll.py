@@ -4,12 +4,165 @@
 # processes multiple countries at once and writes the result for each
 # country into the file $COUNTRY_NAME.csv. Extractiing all ~200
 # countries is thus about two orders of magnitude faster.
+#
+# Besides the per-country files, the list of all countries and their
+# populations is written to "countries.csv". This is everything the
+# dashboard needs, i.e., the output directory can be published as is.
+# Optionally, the data is additionally written in the binary format of
+# "columnarExport.py", either per country or as a single bundle. The
+# dashboard prefers these if they are available. The results of all
+# countries can also be written to a SQLite database which can be
+# queried using "resultStore.py".
+import io
+import os
+import time
+import argparse
 
 import estimateR
+import profiling
+import resultStore
+import columnarExport
+from countryPopulation import readCountryPopulations
+
+def writeCountryFiles(db, outputDir, binary=False):
+    for country in db:
+        with open(os.path.join(outputDir, f"{country}.csv"), "w") as f:
+            estimateR.printCountryCsv(db, country, f)
+
+        if binary:
+            columnarExport.writeCountryBinary(db, country, outputDir)
+
+def rewriteCountryFile(db, country, outputDir, firstRow):
+    """Rewrite the rows of the CSV file of a country from a given data point on.
+
+    The rows before it are left alone, i.e., if new data points have
+    been appended to the database, only the new and the changed rows
+    are written.
+    """
+    fileName = os.path.join(outputDir, f"{country}.csv")
+    if firstRow > 0 and os.path.exists(fileName):
+        with open(fileName, "rb+") as f:
+            # skip the header and the rows which did not change
+            for i in range(firstRow + 1):
+                if not f.readline():
+                    break
+            else:
+                buf = io.StringIO()
+                estimateR.printCountryCsv(db, country, buf, firstRow=firstRow)
+                f.truncate(f.tell())
+                f.write(buf.getvalue().encode())
+                return
+
+    # the file does not exist or it is shorter than expected
+    with open(fileName, "w") as f:
+        estimateR.printCountryCsv(db, country, f)
+
+def writeCountryList(db, populations, outputDir):
+    with open(os.path.join(outputDir, "countries.csv"), "w") as f:
+        for country in sorted(db):
+            population = populations.get(country)
+            if population is None:
+                print(f"{country},\"\"", file=f)
+            else:
+                print(f"{country},{population}", file=f)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the effective reproduction number R of all countries.")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python",
+                        help="the implementation used to compute the derived series")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="the number of processes used to parse the daily reports. 0 means one per CPU")
+    parser.add_argument("-o", "--output-dir", default=".",
+                        help="the directory to which the result files are written")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N",
+                        help="estimate confidence intervals of R using N bootstrap replicates. requires NumPy")
+    parser.add_argument("--noise", choices=["poisson", "negative-binomial"], default="poisson",
+                        help="the noise model of the daily new cases used for the bootstrap")
+    parser.add_argument("--data-dir", default=estimateR.dataSourceDir,
+                        help="the directory containing the daily reports")
+    parser.add_argument("--binary", action="store_true",
+                        help="also write the results in the compact binary format")
+    parser.add_argument("--bundle", action="store_true",
+                        help="also write the data of all countries into a single binary bundle")
+    parser.add_argument("--store", metavar="FILE",
+                        help="also write the results of all countries to a SQLite database, see resultStore.py")
+    parser.add_argument("--watch", type=float, metavar="SECONDS",
+                        help="keep running and check for new daily reports every SECONDS seconds. only the rows affected by them are rewritten")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print the number of days available for each country")
+    profiling.addArguments(parser)
+    args = parser.parse_args()
+
+    estimateR.profiler = profiling.profilerFromArguments(args, estimateR.profiler)
+    profiler = estimateR.profiler
+
+    def computeConfidenceIntervals(db):
+        if args.bootstrap > 0:
+            import confidenceIntervals
+            with profiler.stage("confidenceIntervals"):
+                confidenceIntervals.computeConfidenceIntervals(db,
+                                                               numReplicates=args.bootstrap,
+                                                               noise=args.noise,
+                                                               numProcesses=args.jobs or None)
+
+    def createAndWriteDatabase():
+        db = estimateR.createDatabase(engine=args.engine, numProcesses=args.jobs or None, dataDir=args.data_dir)
+        computeConfidenceIntervals(db)
+
+        with profiler.stage("writeCountryFiles"):
+            writeCountryFiles(db, args.output_dir, binary=args.binary)
+        with profiler.stage("writeCountryList"):
+            writeCountryList(db, populations, args.output_dir)
+        if args.bundle:
+            with profiler.stage("writeBundle"):
+                columnarExport.writeBundle(db, populations, args.output_dir)
+        if args.store:
+            with profiler.stage("writeResultStore"):
+                resultStore.writeResultStore(db, populations, args.store)
+
+        return db
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    populations = readCountryPopulations()
+
+    db = createAndWriteDatabase()
+
+    if args.verbose:
+        for country in sorted(db):
+            print(f"{country}: {len(db[country]['timeList'])}")
+
+    profiler.writeReport(args.profile)
+
+    while args.watch:
+        time.sleep(args.watch)
+
+        numCountries = len(db)
+        changed = estimateR.updateDatabase(db, dataDir=args.data_dir)
+        if changed is None:
+            # e.g., an old report has been corrected
+            if args.verbose:
+                print("recomputing all countries")
+            db = createAndWriteDatabase()
+            continue
+
+        if not changed:
+            continue
 
-db = estimateR.createDatabase()
+        computeConfidenceIntervals({country: db[country] for country in changed})
+        for country, firstRow in changed.items():
+            # the random numbers of the bootstrap depend on the length
+            # of the series, so all confidence intervals change
+            rewriteCountryFile(db, country, args.output_dir, 0 if args.bootstrap > 0 else firstRow)
+            if args.binary:
+                columnarExport.writeCountryBinary(db, country, args.output_dir)
+        if len(db) != numCountries:
+            writeCountryList(db, populations, args.output_dir)
+        if args.bundle:
+            columnarExport.writeBundle(db, populations, args.output_dir)
+        if args.store:
+            # as for the CSV files, all rows change with the bootstrap
+            resultStore.writeResultStore(db, populations, args.store,
+                                         {country: 0 for country in changed} if args.bootstrap > 0 else changed)
 
-for country in db:
-    f = open(f"{country}.csv", "w")
-    estimateR.printCountryCsv(db, country, f)
-    f.close()
+        if args.verbose:
+            print(f"updated {len(changed)} countries up to {max(db[c]['timeList'][-1] for c in changed):%Y-%m-%d}")
@@ -0,0 +1,137 @@
+#! /usr/bin/python3
+#
+# Generate a directory of synthetic daily reports in the format used by
+# Johns Hopkins University. This allows to run and benchmark the
+# scripts without cloning the (large) repository of the real data.
+#
+# Reports before March 22, 2020 use the old column layout
+# ("Province/State,Country/Region,..."), later reports use the new one
+# ("FIPS,Admin2,Province_State,Country_Region,..."). The numbers
+# follow a few random waves per province and are not meant to be
+# realistic in any way.
+import os
+import csv
+import math
+import random
+import argparse
+import datetime
+
+from countryNames import correctCountryName
+from countryPopulation import readCountryPopulations
+
+format1Date = datetime.datetime(2020, 3, 22)
+
+oldHeader = ["Province/State", "Country/Region", "Last Update", "Confirmed", "Deaths", "Recovered"]
+newHeader = ["FIPS", "Admin2", "Province_State", "Country_Region", "Last_Update", "Lat", "Long_",
+             "Confirmed", "Deaths", "Recovered", "Active", "Combined_Key", "Incident_Rate", "Case_Fatality_Ratio"]
+
+# some countries are listed under names which need to be normalized.
+# this includes names which need to be quoted in CSV files.
+rawNames = {
+    "South Korea": "Korea, South",
+    "Taiwan": "Taiwan*",
+}
+
+# estimateR.py applies errata to the data of these countries on
+# specific days, which the synthetic data does not necessarily cover
+excludedCountries = ["United States of America", "United Kingdom"]
+
+def countryNameList(numCountries):
+    """Return the names of the countries as they appear in the reports."""
+    populationsFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "country-populations.csv")
+    names = [n for n in sorted(readCountryPopulations(populationsFile)) if correctCountryName(n) not in excludedCountries]
+    names = [rawNames.get(n, n) for n in names]
+
+    # if more countries are requested than exist, derive new names
+    result = []
+    suffix = ""
+    while len(result) < numCountries:
+        for name in names:
+            if len(result) >= numCountries:
+                break
+            result.append(name + suffix)
+        suffix += " Extra"
+
+    return result
+
+class Province:
+    def __init__(self, rng, firstDay):
+        self.firstDay = firstDay
+        self.totalCases = 0
+        self.totalDeaths = 0
+        self.lethality = rng.uniform(0.005, 0.03)
+        # (peak day, width, height) of the waves
+        self.waves = [(rng.uniform(0, 1000), rng.uniform(10, 60), rng.uniform(10, 5000)) for i in range(4)]
+
+    def advance(self, rng, day):
+        if day < self.firstDay:
+            return False
+
+        expected = sum(h*math.exp(-((day - p)/w)**2) for p, w, h in self.waves) + 1
+        newCases = max(0, int(rng.gauss(expected, math.sqrt(expected))))
+        # occasional corrections of previously reported numbers
+        if rng.random() < 0.01:
+            newCases = -min(self.totalCases, rng.randint(0, 50))
+
+        self.totalCases += newCases
+        self.totalDeaths += int(max(newCases, 0)*self.lethality + rng.random())
+        return True
+
+def generate(outputDir, numDays=900, numCountries=50, numProvinces=3,
+             firstDate=datetime.datetime(2020, 1, 22), seed=1):
+    os.makedirs(outputDir, exist_ok=True)
+
+    rng = random.Random(seed)
+
+    countries = countryNameList(numCountries)
+    provinces = {}
+    for country in countries:
+        # the data of most countries starts after the first report
+        firstDay = rng.choice([0, rng.randint(0, 60)])
+        names = [""] if numProvinces <= 1 else [f"Province {chr(65 + i//26)}{chr(65 + i%26)}" for i in range(numProvinces)]
+        provinces[country] = [(name, Province(rng, firstDay)) for name in names]
+
+    for day in range(numDays):
+        dt = firstDate + datetime.timedelta(days=day)
+        lastUpdate = dt.strftime("%Y-%m-%dT23:59:59")
+
+        with open(os.path.join(outputDir, dt.strftime("%m-%d-%Y.csv")), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(oldHeader if dt < format1Date else newHeader)
+
+            for country in countries:
+                for provinceName, province in provinces[country]:
+                    if not province.advance(rng, day):
+                        continue
+
+                    if dt < format1Date:
+                        writer.writerow([provinceName, country, lastUpdate,
+                                         province.totalCases, province.totalDeaths, ""])
+                    else:
+                        combinedKey = f"{provinceName}, {country}" if provinceName else country
+                        writer.writerow(["", "", provinceName, country, lastUpdate, "0.0", "0.0",
+                                         province.totalCases, province.totalDeaths, "", "",
+                                         combinedKey, "", ""])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic daily reports in the format used by Johns Hopkins University.")
+    parser.add_argument("output_dir",
+                        help="the directory to which the reports are written")
+    parser.add_argument("--days", type=int, default=900,
+                        help="the number of daily reports")
+    parser.add_argument("--countries", type=int, default=50,
+                        help="the number of countries")
+    parser.add_argument("--provinces", type=int, default=3,
+                        help="the number of provinces of each country")
+    parser.add_argument("--first-date", default="2020-01-22",
+                        help="the date of the first report (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="the seed of the random number generator")
+    args = parser.parse_args()
+
+    generate(args.output_dir,
+             numDays=args.days,
+             numCountries=args.countries,
+             numProvinces=args.provinces,
+             firstDate=datetime.datetime.strptime(args.first_date, "%Y-%m-%d"),
+             seed=args.seed)
@@ -0,0 +1,149 @@
+#! /usr/bin/python3
+#
+# Optional instrumentation of the stages of the R estimation. If it is
+# enabled, the wall clock and CPU time of each stage, a few counters
+# and the time spent for each country are recorded and written to a
+# JSON report. Optionally, the functions are profiled using cProfile
+# and the peak memory of each stage is determined using tracemalloc.
+#
+# Profiling is disabled by default, in which case a NullProfiler is
+# used whose methods do nothing. It can be enabled by the "--profile"
+# options of the scripts or by setting the environment variable
+# ESTIMATER_PROFILE to the name of the report file. The variables
+# ESTIMATER_PROFILE_FUNCTIONS and ESTIMATER_PROFILE_MEMORY enable
+# cProfile and tracemalloc if they are set to "1".
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import datetime
+import contextlib
+import tracemalloc
+
+class NullProfiler:
+    enabled = False
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def count(self, name, n=1):
+        pass
+
+    def countryTime(self, country, seconds):
+        pass
+
+    def writeReport(self, fileName=None):
+        pass
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, reportFileName=None, profileFunctions=False, traceMemory=False):
+        self.reportFileName = reportFileName
+        self.stages = {}
+        self.counters = {}
+        self.countries = {}
+        self.startTime = time.perf_counter()
+        self.startCpuTime = time.process_time()
+
+        self.functionProfile = None
+        if profileFunctions:
+            self.functionProfile = cProfile.Profile()
+            self.functionProfile.enable()
+
+        self.traceMemory = traceMemory
+        if traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.traceMemory:
+            tracemalloc.reset_peak()
+
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        try:
+            yield
+        finally:
+            s = self.stages.setdefault(name, {
+                "calls": 0,
+                "wallSeconds": 0.0,
+                "cpuSeconds": 0.0,
+            })
+            s["calls"] += 1
+            s["wallSeconds"] += time.perf_counter() - t0
+            s["cpuSeconds"] += time.process_time() - c0
+
+            if self.traceMemory:
+                peak = tracemalloc.get_traced_memory()[1]
+                s["peakMemory"] = max(s.get("peakMemory", 0), peak)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def countryTime(self, country, seconds):
+        self.countries[country] = self.countries.get(country, 0.0) + seconds
+
+    def report(self):
+        result = {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "command": sys.argv,
+            "wallSeconds": time.perf_counter() - self.startTime,
+            "cpuSeconds": time.process_time() - self.startCpuTime,
+            "stages": self.stages,
+            "counters": self.counters,
+            "countries": self.countries,
+        }
+
+        if self.traceMemory:
+            result["peakMemory"] = tracemalloc.get_traced_memory()[1]
+
+        return result
+
+    def writeReport(self, fileName=None):
+        fileName = fileName or self.reportFileName
+        if fileName is None:
+            return
+
+        report = self.report()
+
+        if self.functionProfile is not None:
+            # the function profile is written next to the report. it can
+            # be inspected using e.g. "python3 -m pstats"
+            self.functionProfile.disable()
+            profileFileName = os.path.splitext(fileName)[0] + ".prof"
+            self.functionProfile.dump_stats(profileFileName)
+            report["functionProfile"] = profileFileName
+
+        with open(fileName, "w") as f:
+            json.dump(report, f, indent=2)
+
+def addArguments(parser):
+    """Add the command line options which enable profiling to an argparse parser."""
+    parser.add_argument("--profile", metavar="REPORT_FILE",
+                        help="record the cost of the individual stages and write it to this JSON file")
+    parser.add_argument("--profile-functions", action="store_true",
+                        help="additionally profile the functions using cProfile")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="additionally record the peak memory of the stages using tracemalloc")
+
+def profilerFromArguments(args, default):
+    if not args.profile:
+        return default
+
+    return Profiler(args.profile,
+                    profileFunctions=args.profile_functions,
+                    traceMemory=args.profile_memory)
+
+def profilerFromEnvironment():
+    reportFileName = os.environ.get("ESTIMATER_PROFILE")
+    if not reportFileName:
+        return NullProfiler()
+
+    profiler = Profiler(reportFileName,
+                        profileFunctions=os.environ.get("ESTIMATER_PROFILE_FUNCTIONS") == "1",
+                        traceMemory=os.environ.get("ESTIMATER_PROFILE_MEMORY") == "1")
+    atexit.register(profiler.writeReport)
+    return profiler
@@ -0,0 +1,316 @@
+#! /usr/bin/python3
+#
+# A small HTTP service which keeps the database of estimateR.py in
+# memory and answers queries for the series of one or more countries,
+# e.g.:
+#
+#   /countries
+#   /series?country=Germany&country=France&from=2021-01-01&to=2021-06-30
+#   /series?country=Germany&columns=deltaCasesSmoothened,estimatedRSmoothened&per=100000&format=csv
+#
+# The parameters of /series are:
+#
+# - country: the name of a country. can be specified multiple times
+# - from, to: the first and the last date (YYYY-MM-DD) of the result
+# - columns: comma separated list of the series to return. by default,
+#   the series of the per-country CSV files are returned
+# - per: divide all numbers of people by the population of the country
+#   and multiply them by this number, e.g. 100000 for "per 100k"
+# - format: "json" (default) or "csv"
+#
+# The daily reports are checked for changes periodically. If there are
+# any, a new database is computed in a separate process (only the new
+# reports need to be parsed thanks to the ingestion cache) and replaces
+# the old one atomically, i.e., each query is answered using either
+# the old or the new database, never a mixture of both. Since the
+# database does not change otherwise, the responses are cached.
+#
+# Only the Python standard library is used. The service does not
+# implement HTTPS and is meant to be run behind a proper web server.
+import os
+import sys
+import json
+import math
+import hashlib
+import asyncio
+import argparse
+import datetime
+import functools
+import concurrent.futures
+from urllib.parse import urlsplit, parse_qs
+
+import estimateR
+import columnarExport
+from countrySeries import seriesNames, ratioSeriesNames
+from countryPopulation import readCountryPopulations
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def reportSignature(dataDir):
+    """Return a value which changes whenever a daily report is added or modified."""
+    result = []
+    for fileName in estimateR.listDailyReports(dataDir):
+        st = os.stat(os.path.join(dataDir, fileName))
+        result.append((fileName, st.st_mtime_ns, st.st_size))
+    return tuple(result)
+
+def buildDatabase(dataDir, engine, numProcesses):
+    # this is run in a separate process, so that answering queries is
+    # not slowed down while the database is computed
+    signature = reportSignature(dataDir)
+    db = estimateR.createDatabase(engine=engine, numProcesses=numProcesses, dataDir=dataDir)
+    return signature, db
+
+def parseDate(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise QueryError(400, f"Invalid date '{value}'")
+
+class Snapshot:
+    """A database together with everything which is needed to answer queries about it."""
+
+    def __init__(self, db, populations, signature):
+        self.db = db
+        self.populations = populations
+        self.signature = signature
+        self.created = datetime.datetime.now().isoformat(timespec="seconds")
+        # hash() is salted per process, but the version must be the
+        # same for every instance of the service which serves the data
+        self.version = hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+
+        # the dates are formatted once instead of for each query
+        self.dates = {country: [t.strftime("%Y-%m-%d") for t in entry["timeList"]]
+                      for country, entry in db.items()}
+
+        self.query = functools.lru_cache(maxsize=256)(self.computeQuery)
+
+    def countryList(self):
+        return [{
+            "name": country,
+            "population": self.populations.get(country),
+            "firstDate": self.dates[country][0] if self.dates[country] else None,
+            "lastDate": self.dates[country][-1] if self.dates[country] else None,
+        } for country in sorted(self.db)]
+
+    def seriesOf(self, country, columns, first, last, per):
+        entry = self.db.get(country)
+        if entry is None:
+            raise QueryError(404, f"Unknown country '{country}'")
+
+        factor = None
+        if per is not None:
+            population = self.populations.get(country)
+            if population is None:
+                raise QueryError(400, f"The population of '{country}' is unknown")
+            factor = per/population
+
+        i0, i1 = entry.indexRange(first, last)
+        result = {}
+        for name in columns:
+            # e.g. the confidence intervals are only available if they
+            # have been computed
+            if name not in entry:
+                raise QueryError(400, f"Column '{name}' is not available for '{country}'")
+            values = entry[name][i0:i1]
+            # some series are shorter than the time list
+            values += [None]*(i1 - i0 - len(values))
+            # the estimated R is not a number of people
+            if factor is not None and name not in ratioSeriesNames:
+                values = [None if x is None else x*factor for x in values]
+            result[name] = values
+
+        return self.dates[country][i0:i1], result
+
+    def computeQuery(self, path, query):
+        """Return the content type and the body of the response to a query.
+
+        `query` is a sorted tuple of (name, values) pairs. This is cached,
+        so it must only depend on the arguments and the snapshot.
+        """
+        params = dict(query)
+
+        if path == "/countries":
+            return "application/json", json.dumps(self.countryList()).encode()
+
+        if path == "/status":
+            return "application/json", json.dumps({
+                "version": self.version,
+                "created": self.created,
+                "reports": len(self.signature),
+                "countries": len(self.db),
+            }).encode()
+
+        if path != "/series":
+            raise QueryError(404, f"Unknown path '{path}'")
+
+        countries = params.get("country")
+        if not countries:
+            raise QueryError(400, "No country specified")
+
+        columns = columnarExport.columnNames
+        if "columns" in params:
+            columns = [c for value in params["columns"] for c in value.split(",") if c]
+            for name in columns:
+                if name not in seriesNames:
+                    raise QueryError(400, f"Unknown column '{name}'")
+
+        first = parseDate(params["from"][-1]) if "from" in params else None
+        last = parseDate(params["to"][-1]) if "to" in params else None
+
+        per = None
+        if "per" in params:
+            try:
+                per = float(params["per"][-1])
+            except ValueError:
+                raise QueryError(400, f"Invalid value '{params['per'][-1]}' for 'per'")
+            # NaN and infinity cannot be represented in JSON
+            if not math.isfinite(per) or per <= 0:
+                raise QueryError(400, f"Invalid value '{params['per'][-1]}' for 'per'")
+
+        fmt = params.get("format", ["json"])[-1]
+        if fmt not in ["json", "csv"]:
+            raise QueryError(400, f"Unknown format '{fmt}'")
+
+        results = [(country, *self.seriesOf(country, columns, first, last, per)) for country in countries]
+
+        if fmt == "json":
+            body = {country: {"dates": dates, "columns": series} for country, dates, series in results}
+            return "application/json", json.dumps(body).encode()
+
+        lines = [",".join(["Country", "Date"] + columns)]
+        for country, dates, series in results:
+            quotedCountry = '"' + country.replace('"', '""') + '"'
+            for i, date in enumerate(dates):
+                values = ["" if series[name][i] is None else str(series[name][i]) for name in columns]
+                lines.append(",".join([quotedCountry, date] + values))
+        return "text/csv", ("\n".join(lines) + "\n").encode()
+
+class QueryServer:
+    def __init__(self, dataDir, engine="python", numProcesses=1, reloadInterval=60):
+        self.dataDir = dataDir
+        self.engine = engine
+        self.numProcesses = numProcesses
+        self.reloadInterval = reloadInterval
+        self.populations = readCountryPopulations()
+        self.snapshot = None
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+
+    async def load(self):
+        loop = asyncio.get_running_loop()
+        signature, db = await loop.run_in_executor(self.executor, buildDatabase,
+                                                   self.dataDir, self.engine, self.numProcesses)
+        # replacing the reference is atomic. queries which are in
+        # progress keep using the previous snapshot
+        self.snapshot = Snapshot(db, self.populations, signature)
+        print(f"loaded {len(signature)} daily reports, version {self.snapshot.version}", file=sys.stderr)
+
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reloadInterval)
+            try:
+                signature = await loop.run_in_executor(None, reportSignature, self.dataDir)
+                if signature != self.snapshot.signature:
+                    await self.load()
+            except Exception as e:
+                # keep serving the old data if the new one is broken
+                print(f"reloading the database failed: {e}", file=sys.stderr)
+
+    def respond(self, target):
+        url = urlsplit(target)
+        query = tuple(sorted((name, tuple(values)) for name, values in parse_qs(url.query).items()))
+        snapshot = self.snapshot
+        try:
+            contentType, body = snapshot.query(url.path.rstrip("/") or "/", query)
+            return 200, contentType, body, snapshot.version
+        except QueryError as e:
+            return e.status, "application/json", json.dumps({"error": str(e)}).encode(), None
+        except Exception as e:
+            # a bug must not leave the client without a response
+            print(f"answering '{target}' failed: {e!r}", file=sys.stderr)
+            return 500, "application/json", b'{"error": "Internal server error"}', None
+
+    async def handleConnection(self, reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in [b"\r\n", b"\n", b""]:
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, version = requestLine.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                keepAlive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                if method not in ["GET", "HEAD"]:
+                    status, contentType, body, etag = 405, "application/json", b'{"error": "Method not allowed"}', None
+                else:
+                    status, contentType, body, etag = self.respond(target)
+
+                responseHeaders = [
+                    f"Content-Type: {contentType}",
+                    "Access-Control-Allow-Origin: *",
+                    "Connection: " + ("keep-alive" if keepAlive else "close"),
+                ]
+                if etag is not None:
+                    responseHeaders.append(f'ETag: "{etag}"')
+                    if headers.get("if-none-match") == f'"{etag}"':
+                        status, body = 304, b""
+                responseHeaders.append(f"Content-Length: {len(body)}")
+
+                reason = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}[status]
+                writer.write(f"HTTP/1.1 {status} {reason}\r\n".encode() +
+                             "\r\n".join(responseHeaders).encode() + b"\r\n\r\n")
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+
+                if not keepAlive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        await self.load()
+        server = await asyncio.start_server(self.handleConnection, host, port)
+        print(f"serving on http://{host}:{port}/", file=sys.stderr)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.watch())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the estimated R of all countries via HTTP.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="the address to listen on")
+    parser.add_argument("--port", type=int, default=8080,
+                        help="the port to listen on")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python",
+                        help="the implementation used to compute the derived series")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="the number of processes used to parse the daily reports. 0 means one per CPU")
+    parser.add_argument("--data-dir", default=estimateR.dataSourceDir,
+                        help="the directory containing the daily reports")
+    parser.add_argument("--reload-interval", type=float, default=60,
+                        help="the number of seconds between checks for new daily reports")
+    args = parser.parse_args()
+
+    server = QueryServer(args.data_dir, args.engine, args.jobs or None, args.reload_interval)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,330 @@
+#! /usr/bin/python3
+#
+# Store the results of estimateR.py in a single SQLite database and
+# answer questions about all countries without reading the per-country
+# CSV files, e.g.:
+#
+#   ./resultStore.py build
+#   ./resultStore.py latest --column estimatedRSmoothened
+#   ./resultStore.py top --column deltaCases --days 7 --per 100000 -n 10
+#   ./resultStore.py series Germany --from 2021-01-01 --columns deltaCases,estimatedR
+#   ./resultStore.py --store updated.sqlite compare rebuilt.sqlite
+#
+# The store contains two tables: "countries", which lists each country
+# with its population and its first and last date, and "series", which
+# contains one row per country and date with one column for each of the
+# series of countrySeries.py. The rows of "series" are ordered by
+# (country, date), and there is an additional index on the date, so
+# both the history of a country and the values of all countries on
+# some day can be looked up without scanning the whole table. Missing
+# values are NULL, dates are stored as YYYY-MM-DD strings.
+#
+# A new store is written to a temporary file which then replaces the
+# old one, i.e., readers never see a partially written store. When new
+# daily reports are added, only the affected rows are replaced (see the
+# `--store` option of estimateRAll.py).
+import os
+import sys
+import csv
+import math
+import sqlite3
+import argparse
+import datetime
+
+import estimateR
+from countrySeries import seriesNames, countSeriesNames, ratioSeriesNames, cumulativeSeriesNames
+from countryPopulation import readCountryPopulations
+
+# the default location of the store
+resultStoreFile = "results.sqlite"
+
+# increase this whenever the layout of the store changes
+storeVersion = 1
+
+def createTables(connection):
+    columns = ", ".join(f"{name} {'INTEGER' if name in countSeriesNames else 'REAL'}" for name in seriesNames)
+    connection.executescript(f"""
+        CREATE TABLE countries (
+            country TEXT PRIMARY KEY,
+            population REAL,
+            firstDate TEXT,
+            lastDate TEXT
+        );
+        CREATE TABLE series (
+            country TEXT NOT NULL,
+            date TEXT NOT NULL,
+            {columns},
+            PRIMARY KEY (country, date)
+        ) WITHOUT ROWID;
+        CREATE INDEX seriesByDate ON series (date);
+        PRAGMA user_version = {storeVersion};
+    """)
+
+def seriesRows(entry, country, firstRow=0):
+    """Yield the rows of the "series" table for the data points of a country from `firstRow` on."""
+    dates = [t.strftime("%Y-%m-%d") for t in entry.timeList()[firstRow:]]
+
+    columns = []
+    for name in seriesNames:
+        values = getattr(entry, name)
+        values = [] if values is None else values[firstRow:]
+        # some series are shorter than the time list
+        columns.append([None if math.isnan(x) else x for x in values] + [None]*(len(dates) - len(values)))
+
+    for date, *values in zip(dates, *columns):
+        yield (country, date, *values)
+
+def storeCountries(connection, db, countries, populations, firstRows):
+    insertRow = f"INSERT INTO series VALUES ({', '.join(['?']*(len(seriesNames) + 2))})"
+
+    for country in countries:
+        entry = db[country]
+        firstRow = firstRows.get(country, 0)
+        if firstRow > 0:
+            connection.execute("DELETE FROM series WHERE country = ? AND date >= ?",
+                               (country, entry.dateAxis[entry.dayIndices[firstRow]].strftime("%Y-%m-%d")))
+        else:
+            connection.execute("DELETE FROM series WHERE country = ?", (country,))
+        connection.executemany(insertRow, seriesRows(entry, country, firstRow))
+
+        timeList = entry.timeList()
+        connection.execute("INSERT OR REPLACE INTO countries VALUES (?, ?, ?, ?)",
+                           (country,
+                            populations.get(country),
+                            timeList[0].strftime("%Y-%m-%d") if timeList else None,
+                            timeList[-1].strftime("%Y-%m-%d") if timeList else None))
+
+def writeResultStore(db, populations, fileName=resultStoreFile, changed=None):
+    """Write the results of all countries of a database to a store.
+
+    If `changed` is specified, it must be the result of
+    estimateR.updateDatabase(), i.e., a dictionary which maps the
+    countries which have changed to the index of their first changed
+    data point. Only these rows are replaced in the existing store.
+    """
+    if changed is not None and os.path.exists(fileName):
+        with sqlite3.connect(fileName) as connection:
+            storeCountries(connection, db, changed, populations, changed)
+        connection.close()
+        return
+
+    tmpFileName = fileName + ".tmp"
+    if os.path.exists(tmpFileName):
+        os.remove(tmpFileName)
+
+    connection = sqlite3.connect(tmpFileName)
+    with connection:
+        createTables(connection)
+        storeCountries(connection, db, sorted(db), populations, {})
+    connection.close()
+
+    os.replace(tmpFileName, fileName)
+
+def checkColumn(name):
+    # the column names are inserted into the SQL statements, so they
+    # must be checked
+    if name not in seriesNames:
+        raise ValueError(f"Unknown column '{name}'")
+    return name
+
+class ResultStore:
+    """Read-only access to a store written by writeResultStore()."""
+
+    def __init__(self, fileName=resultStoreFile):
+        if not os.path.exists(fileName):
+            raise FileNotFoundError(f"The result store '{fileName}' does not exist")
+
+        self.connection = sqlite3.connect(f"file:{fileName}?mode=ro", uri=True)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != storeVersion:
+            self.connection.close()
+            raise ValueError(f"The result store '{fileName}' uses version {version} instead of {storeVersion}. Rebuild it")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def countries(self):
+        """Return a list of `(country, population, firstDate, lastDate)` tuples."""
+        return self.connection.execute("SELECT * FROM countries ORDER BY country").fetchall()
+
+    def lastDate(self):
+        return self.connection.execute("SELECT max(lastDate) FROM countries").fetchone()[0]
+
+    def series(self, country, columns=None, first=None, last=None):
+        """Return the values of some series of a country as a list of `(date, *values)` tuples.
+
+        `first` and `last` are inclusive dates (YYYY-MM-DD). If one of
+        them is None, the result is not limited in this direction.
+        """
+        columns = [checkColumn(name) for name in (columns or seriesNames)]
+        return self.connection.execute(f"""
+            SELECT date, {", ".join(columns)} FROM series
+            WHERE country = ? AND date >= ? AND date <= ?
+            ORDER BY date""", (country, first or "", last or "9999")).fetchall()
+
+    def latest(self, column="estimatedRSmoothened"):
+        """Return the last known value of a series for all countries.
+
+        The result is a list of `(country, date, value)` tuples. Countries
+        for which the series is not available are omitted.
+        """
+        column = checkColumn(column)
+        return self.connection.execute(f"""
+            SELECT c.country, s.date, s.{column} FROM countries c JOIN series s
+            ON s.country = c.country AND s.date = (
+                SELECT date FROM series
+                WHERE country = c.country AND {column} IS NOT NULL
+                ORDER BY date DESC LIMIT 1)
+            ORDER BY c.country""").fetchall()
+
+    def ranking(self, column="deltaCases", days=7, per=None, last=None, limit=None):
+        """Rank the countries by a series over the last few days.
+
+        For the daily numbers of people, the values of the days are
+        summed up, for the estimated R they are averaged and for the
+        cumulative series the last value within the period is used. The
+        period ends with `last` (by default the last date of the store)
+        and is `days` days long. If
+        `per` is specified, the numbers of people are divided by the
+        population of each country and multiplied by `per`, e.g. 100000
+        for "per 100k"; countries with unknown population are omitted
+        then. The result is a list of `(country, value)` tuples, highest
+        value first.
+        """
+        column = checkColumn(column)
+        last = last or self.lastDate()
+        if last is None:
+            return []
+        first = (datetime.datetime.strptime(last, "%Y-%m-%d") - datetime.timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+        params = []
+        if column in ratioSeriesNames:
+            value = f"avg(s.{column})"
+        elif column in cumulativeSeriesNames:
+            # sqlite takes the other columns from the row of the maximum
+            value = f"s.{column}"
+        else:
+            value = f"sum(s.{column})"
+        if per is not None and column not in ratioSeriesNames:
+            # the division yields NULL for countries with unknown population
+            value = f"{value}*?/c.population"
+            params.append(per)
+        params += [first, last, -1 if limit is None else limit]
+
+        return self.connection.execute(f"""
+            SELECT country, value FROM (
+                SELECT c.country AS country, {value} AS value, max(s.date) FROM series s JOIN countries c ON s.country = c.country
+                WHERE s.date >= ? AND s.date <= ? AND s.{column} IS NOT NULL
+                GROUP BY c.country)
+            WHERE value IS NOT NULL
+            ORDER BY value DESC, country
+            LIMIT ?""", params).fetchall()
+
+def compareResultStores(fileName, otherFileName):
+    """Return a list of the differences between the contents of two stores.
+
+    This is meant to check that a store which has been updated
+    incrementally is the same as one which has been written from
+    scratch. Each difference is described by a string.
+    """
+    result = []
+    with ResultStore(fileName) as store, ResultStore(otherFileName) as other:
+        countries = {row[0]: row for row in store.countries()}
+        otherCountries = {row[0]: row for row in other.countries()}
+        for country in sorted(set(countries) | set(otherCountries)):
+            if countries.get(country) != otherCountries.get(country):
+                result.append(f"{country}: {countries.get(country)} != {otherCountries.get(country)}")
+                continue
+
+            rows = {row[0]: row for row in store.series(country)}
+            otherRows = {row[0]: row for row in other.series(country)}
+            for date in sorted(set(rows) | set(otherRows)):
+                row = rows.get(date) or (date,) + (None,)*len(seriesNames)
+                otherRow = otherRows.get(date) or (date,) + (None,)*len(seriesNames)
+                for name, value, otherValue in zip(seriesNames, row[1:], otherRow[1:]):
+                    if value != otherValue:
+                        result.append(f"{country}, {date}, {name}: {value} != {otherValue}")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store the estimated R of all countries in a SQLite database and query it.")
+    parser.add_argument("--store", default=resultStoreFile,
+                        help="the file containing the store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="compute the results of all countries and write them to the store")
+    build.add_argument("--engine", choices=["python", "numpy"], default="python",
+                       help="the implementation used to compute the derived series")
+    build.add_argument("-j", "--jobs", type=int, default=1,
+                       help="the number of processes used to parse the daily reports. 0 means one per CPU")
+    build.add_argument("--data-dir", default=estimateR.dataSourceDir,
+                       help="the directory containing the daily reports")
+
+    latest = commands.add_parser("latest", help="print the last known value of a series for all countries")
+    latest.add_argument("--column", default="estimatedRSmoothened",
+                        help="the series to print")
+
+    top = commands.add_parser("top", help="rank the countries by a series over the last few days")
+    top.add_argument("--column", default="deltaCases",
+                     help="the series to rank the countries by")
+    top.add_argument("--days", type=int, default=7,
+                     help="the number of days considered")
+    top.add_argument("--date", help="the last day considered (YYYY-MM-DD). defaults to the last date of the store")
+    top.add_argument("--per", type=float,
+                     help="divide the numbers of people by the population of the country and multiply them by this number")
+    top.add_argument("-n", "--limit", type=int, default=10,
+                     help="the number of countries printed")
+
+    series = commands.add_parser("series", help="print some series of a country")
+    series.add_argument("country")
+    series.add_argument("--from", dest="first", help="the first date (YYYY-MM-DD)")
+    series.add_argument("--to", dest="last", help="the last date (YYYY-MM-DD)")
+    series.add_argument("--columns", help="comma separated list of the series to print")
+
+    compare = commands.add_parser("compare", help="check that the store has the same contents as another one")
+    compare.add_argument("other",
+                         help="the file containing the other store")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        try:
+            differences = compareResultStores(args.store, args.other)
+        except (ValueError, FileNotFoundError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        for difference in differences:
+            print(difference)
+        print(f"{len(differences)} differences", file=sys.stderr)
+        sys.exit(1 if differences else 0)
+
+    if args.command == "build":
+        db = estimateR.createDatabase(engine=args.engine, numProcesses=args.jobs or None, dataDir=args.data_dir)
+        writeResultStore(db, readCountryPopulations(), args.store)
+        sys.exit(0)
+
+    try:
+        with ResultStore(args.store) as store:
+            if args.command == "latest":
+                header = ["Country", "Date", args.column]
+                rows = store.latest(args.column)
+            elif args.command == "top":
+                header = ["Country", args.column]
+                rows = store.ranking(args.column, args.days, args.per, args.date, args.limit)
+            elif args.command == "series":
+                columns = args.columns.split(",") if args.columns else seriesNames
+                header = ["Date"] + columns
+                rows = store.series(args.country, columns, args.first, args.last)
+    except (ValueError, FileNotFoundError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(header)
+    writer.writerows(rows)
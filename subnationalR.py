@@ -0,0 +1,192 @@
+#! /usr/bin/python3
+#
+# Estimate R for the provinces, states and counties of all countries.
+#
+# Besides the country, the daily reports since March 22, 2020 specify
+# the province or state ("Province_State") and, for the US, the county
+# ("Admin2") of each row. This script keeps these regions apart
+# instead of adding everything up per country. The regions form a
+# hierarchy which is identified by keys of the form
+#
+#   (country,), (country, province) and (country, province, county)
+#
+# The numbers of a region include those of all regions within it, so
+# the entries of the countries are the same as the ones produced by
+# estimateR.createDatabase(). All levels are accumulated in a single
+# pass over the daily reports.
+#
+# There are about 20 times more regions than countries. To keep the
+# memory bounded, the daily reports are merged as they are parsed and
+# the derived series are computed in chunks of regions. The derived
+# series of a chunk are dropped once the chunk has been written.
+import os
+import csv
+import argparse
+import datetime
+
+import estimateR
+from countrySeries import CountrySeries
+
+def regionKeys(country, province, county):
+    """Return the keys of all regions which a row of a daily report contributes to."""
+    keys = [(country,)]
+    if province or county:
+        keys.append((country, province))
+        if county:
+            keys.append((country, province, county))
+    return keys
+
+# replaces the empty parts of region keys in names and file names, e.g.
+# the province of a county whose province is not specified
+unknownRegion = "_"
+
+def regionName(key):
+    """Return the name of a region in the style of the "Combined_Key" column of the reports."""
+    return ", ".join(part or unknownRegion for part in reversed(key))
+
+def parseDailyReportRegions(filePath):
+    """Read a daily report and accumulate the numbers of each region.
+
+    The result maps the key of each region to a `[totalCases,
+    totalDeaths]` list.
+    """
+    dt = estimateR.fileNameToDateTime(os.path.basename(filePath))
+    oldFormat = dt < datetime.datetime(2020, 3, 22)
+
+    result = {}
+    with open(filePath, newline="") as f:
+        csv_reader = csv.reader(f, delimiter=",")
+        header = next(csv_reader, None)
+        if header is None:
+            # an empty report
+            return result
+
+        for fields in csv_reader:
+            row = estimateR.parseReportRow(fields, oldFormat)
+            if row is None:
+                continue
+            country, province, county, numCases, numDeaths = row
+
+            for key in regionKeys(country, province, county):
+                if key not in result:
+                    result[key] = [0, 0]
+
+                result[key][0] += numCases
+                result[key][1] += numDeaths
+
+    return result
+
+def ingestRegions(dataDir=None, numProcesses=1, countries=None):
+    """Read the total numbers of all regions from the daily reports.
+
+    The result maps the key of each region to a CountrySeries object
+    which only contains the total numbers. The keys are sorted, i.e.,
+    each region is directly followed by the regions within it. If
+    `countries` is specified, only the regions of these countries are
+    considered. The errata of estimateR.py are applied to the
+    countries, but not to the regions within them.
+    """
+    if dataDir is None:
+        dataDir = estimateR.dataSourceDir
+    fileNames = estimateR.listDailyReports(dataDir)
+    filePaths = [os.path.join(dataDir, fileName) for fileName in fileNames]
+    dateAxis = [estimateR.fileNameToDateTime(fileName) for fileName in fileNames]
+
+    db = {}
+    def merge(results):
+        # the results are merged as they become available, so only a
+        # few parsed files are kept in memory at any time
+        for dayIdx, result in enumerate(results):
+            for key, (numCases, numDeaths) in result.items():
+                if countries is not None and key[0] not in countries:
+                    continue
+
+                if key not in db:
+                    db[key] = CountrySeries(dateAxis)
+                db[key].append(dayIdx, numCases, numDeaths)
+
+    if numProcesses == 1 or len(filePaths) < 2:
+        merge(map(parseDailyReportRegions, filePaths))
+    else:
+        import multiprocessing
+        numProcesses = numProcesses or os.cpu_count()
+        with multiprocessing.Pool(numProcesses) as pool:
+            merge(pool.imap(parseDailyReportRegions, filePaths, 4))
+
+    estimateR.applyErrata({key[0]: entry for key, entry in db.items() if len(key) == 1})
+
+    return dict(sorted(db.items()))
+
+def childRegions(db):
+    """Return a dictionary which maps the key of each region to the keys of the regions directly within it.
+
+    The key of the root of the hierarchy is the empty tuple, i.e., its
+    children are the countries.
+    """
+    result = {(): []}
+    for key in db:
+        result.setdefault(key, [])
+        result.setdefault(key[:-1], []).append(key)
+    return result
+
+def iterRegionChunks(db, engine="numpy", chunkSize=256, keepSeries=False):
+    """Compute the derived series of all regions, one chunk of regions at a time.
+
+    This yields a dictionary which maps the names of the regions of
+    each chunk to their entries. Unless `keepSeries` is true, the
+    derived series of a chunk are dropped when the next chunk is
+    requested.
+    """
+    keys = list(db)
+    for i in range(0, len(keys), chunkSize):
+        chunk = {regionName(key): db[key] for key in keys[i:i + chunkSize]}
+        estimateR.computeDerivedSeries(chunk, engine)
+
+        yield chunk
+
+        if not keepSeries:
+            for entry in chunk.values():
+                entry.clearDerivedSeries()
+
+def regionFileName(outputDir, key):
+    # e.g. "US.csv", "US/New York.csv" and "US/New York/Albany.csv"
+    return os.path.join(outputDir, *[part.replace("/", "_") or unknownRegion for part in key]) + ".csv"
+
+def writeRegionFiles(db, outputDir, engine="numpy", chunkSize=256):
+    regions = {regionName(key): key for key in db}
+
+    for chunk in iterRegionChunks(db, engine, chunkSize):
+        for name in chunk:
+            fileName = regionFileName(outputDir, regions[name])
+            os.makedirs(os.path.dirname(fileName), exist_ok=True)
+            with open(fileName, "w") as f:
+                estimateR.printCountryCsv(chunk, name, f)
+
+def writeRegionList(db, outputDir):
+    with open(os.path.join(outputDir, "regions.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Country", "Province", "County", "Days"])
+        for key, entry in db.items():
+            writer.writerow(list(key) + [""]*(3 - len(key)) + [len(entry)])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the effective reproduction number R of all provinces and counties.")
+    parser.add_argument("country", nargs="*",
+                        help="only process the regions of these countries")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="numpy",
+                        help="the implementation used to compute the derived series")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="the number of processes used to parse the daily reports. 0 means one per CPU")
+    parser.add_argument("-o", "--output-dir", default="regions",
+                        help="the directory to which the result files are written")
+    parser.add_argument("--data-dir", default=estimateR.dataSourceDir,
+                        help="the directory containing the daily reports")
+    parser.add_argument("--chunk-size", type=int, default=256,
+                        help="the number of regions whose derived series are computed at once")
+    args = parser.parse_args()
+
+    db = ingestRegions(args.data_dir, args.jobs or None, args.country or None)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    writeRegionFiles(db, args.output_dir, args.engine, args.chunk_size)
+    writeRegionList(db, args.output_dir)
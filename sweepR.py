@@ -0,0 +1,87 @@
+#! /usr/bin/python3
+#
+# Compute the estimated R of all countries for a grid of kernel
+# parameters, i.e., for the same parameters which can be varied using
+# the sliders of the dashboard. All parameter combinations are
+# computed in a single batched pass over the case numbers (see
+# caseMatrix.sweepEstimatedR()), so the daily reports only need to be
+# parsed once.
+#
+# The result is written as a space separated CSV file with one line
+# per country, parameter combination and day. This script requires
+# NumPy.
+import sys
+import math
+import argparse
+
+import estimateR
+import caseMatrix
+
+def parseIntList(value):
+    return [int(x) for x in value.split(",")]
+
+def kernelGrid(numDaysInfectiousList, weightsOffsetList, kList):
+    """Return the (numDaysInfectious, weightsOffset, k) combinations of a parameter grid.
+
+    Combinations where the kernel is empty or where its peak is
+    outside of it are skipped.
+    """
+    return [(n, offset, k)
+            for n in numDaysInfectiousList
+            for offset in weightsOffsetList
+            for k in kList
+            if n >= 1 and 0 <= k <= n]
+
+def sweepDatabase(db, params):
+    kernels = [(estimateR.infectivityWeights(n, k), offset) for n, offset, k in params]
+    return caseMatrix.sweepEstimatedR(caseMatrix.CaseMatrix(db), kernels)
+
+def printSweepCsv(db, params, result, outFile, numLastDays=None):
+    print('Country '+ \
+          '"Days Infectious" '+ \
+          '"Weights Offset" '+ \
+          'k '+ \
+          'Date '+ \
+          '"Estimated R" '+ \
+          '"Smoothened Estimated R"',
+          file=outFile)
+
+    for countryIdx, country in enumerate(result["countries"]):
+        timeList = db[country]["timeList"]
+        i0 = 0 if numLastDays is None else max(0, len(timeList) - numLastDays)
+        dates = [t.strftime("%Y-%m-%d") for t in timeList]
+
+        for paramIdx, (n, offset, k) in enumerate(params):
+            R = result["estimatedR"][paramIdx, countryIdx].tolist()
+            Rs = result["estimatedRSmoothened"][paramIdx, countryIdx].tolist()
+            for i in range(i0, len(timeList)):
+                r = "\"\"" if math.isnan(R[i]) else R[i]
+                rs = "\"\"" if math.isnan(Rs[i]) else Rs[i]
+                print(f'"{country}" {n} {offset} {k} {dates[i]} {r} {rs}', file=outFile)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate R of all countries for a grid of kernel parameters.")
+    parser.add_argument("--days-infectious", type=parseIntList, default=[estimateR.numDaysInfectious],
+                        help="comma separated list of the number of days a case has an effect on the reported cases")
+    parser.add_argument("--weights-offset", type=parseIntList, default=[estimateR.weightsOffset],
+                        help="comma separated list of the first day a case has an influence relative to its report. use --weights-offset=-10,-5 for negative values")
+    parser.add_argument("--k", type=parseIntList, default=[estimateR.k],
+                        help="comma separated list of the centers of infectiousness")
+    parser.add_argument("--last", type=int,
+                        help="only print the results for this number of most recent days")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="the number of processes used to parse the daily reports. 0 means one per CPU")
+    parser.add_argument("--data-dir", default=estimateR.dataSourceDir,
+                        help="the directory containing the daily reports")
+    args = parser.parse_args()
+
+    params = kernelGrid(args.days_infectious, args.weights_offset, args.k)
+    if not params:
+        print("No valid combination of kernel parameters specified", file=sys.stderr)
+        sys.exit(1)
+
+    # only the total numbers are required, the derived series are not
+    db = estimateR.ingestDatabase(numProcesses=args.jobs or None, dataDir=args.data_dir)
+    result = sweepDatabase(db, params)
+
+    printSweepCsv(db, params, result, sys.stdout, numLastDays=args.last)
@@ -0,0 +1,63 @@
+#! /usr/bin/python3
+#
+# Check that the fast parser for the daily reports
+# (estimateR.parseDailyReportFast()) produces exactly the same results
+# as the one based on the csv module (estimateR.parseDailyReport()) for
+# all daily reports, including the order of the countries. The time
+# spent by both parsers is printed as well.
+#
+# Run this after changing either parser or if the format of the daily
+# reports has changed. The exit status is non-zero if any report is
+# parsed differently.
+import os
+import sys
+import time
+import argparse
+
+import estimateR
+
+def compareReport(filePath):
+    t0 = time.perf_counter()
+    expected = estimateR.parseDailyReport(filePath)
+    t1 = time.perf_counter()
+    actual = estimateR.parseDailyReportFast(filePath)
+    t2 = time.perf_counter()
+
+    same = (actual[1] == expected[1] and list(actual[0].items()) == list(expected[0].items()))
+    return same, t1 - t0, t2 - t1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the fast parser for the daily reports to the csv based one.")
+    parser.add_argument("--data-dir", default=estimateR.dataSourceDir,
+                        help="the directory containing the daily reports")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="the number of processes used. 0 means one per CPU")
+    args = parser.parse_args()
+
+    fileNames = estimateR.listDailyReports(args.data_dir)
+    filePaths = [os.path.join(args.data_dir, fileName) for fileName in fileNames]
+
+    if args.jobs == 1:
+        results = list(map(compareReport, filePaths))
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(args.jobs or None) as pool:
+            results = pool.map(compareReport, filePaths, 8)
+
+    # a report which is skipped must never count as a match
+    if len(results) != len(fileNames):
+        print(f"only {len(results)} of {len(fileNames)} daily reports have been compared")
+        sys.exit(1)
+
+    numMismatches = 0
+    for fileName, (same, _, _) in zip(fileNames, results):
+        if not same:
+            print(f"{fileName}: the results of the parsers differ")
+            numMismatches += 1
+
+    csvTime = sum(r[1] for r in results)
+    fastTime = sum(r[2] for r in results)
+    print(f"{len(fileNames)} daily reports, {numMismatches} mismatches")
+    print(f"csv parser: {csvTime:.2f}s, fast parser: {fastTime:.2f}s")
+
+    sys.exit(1 if numMismatches else 0)